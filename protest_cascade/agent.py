@@ -2,6 +2,10 @@ import mesa
 import math
 import logging as log
 
+# conditions an agent can be in, indexed by their compact integer code
+CONDITIONS = ("Support", "Protest", "Jailed")
+CONDITION_CODES = {condition: code for code, condition in enumerate(CONDITIONS)}
+
 
 class RandomWalker(mesa.Agent):
     """
@@ -35,14 +39,23 @@ class RandomWalker(mesa.Agent):
         self.dc_seed = self.model._seed
         self.dc_threshold = self.model.threshold
 
+    def rng(self, purpose):
+        """
+        Random stream for one purpose of this agent (see rng.PURPOSES), or the
+        shared model stream when the model runs with rng="legacy".
+        """
+        streams = self.model.streams
+        if streams is None:
+            return self.model.random
+        return streams.random(purpose, self.unique_id)
+
     def update_neighbors(self):
         """
         Update the list of neighbors.
         """
-        self.neighborhood = self.model.grid.get_neighborhood(
+        self.neighbors = self.model.grid.get_neighborhood_contents(
             self.pos, moore=True, radius=self.vision
         )
-        self.neighbors = self.model.grid.get_cell_list_contents(self.neighborhood)
 
     def random_move(self):
         """
@@ -69,10 +82,13 @@ class RandomWalker(mesa.Agent):
             return
 
         # randomly choose valid move
-        next_move = self.random.choice(next_moves)
+        next_move = self.rng("move").choice(next_moves)
 
         # Now move:
+        previous = self.pos
         self.model.grid.move_agent(self, next_move)
+        if self.model.events is not None and self.pos != previous:
+            self.model.events.move(self)
 
     def determine_avg_loc(self):
         """
@@ -167,13 +183,31 @@ class Citizen(RandomWalker):
 
         # agent memory attributes
         self.network = None
+        self.network_index = None
         self.flip = None
         self.ever_flipped = False
         self.memory = None
         self.condition = "Support"
 
         # agent jail attributes
-        self.jail_sentence = 0
+        self._jail_sentence = 0
+        # schedule step at which the model's jail lets the citizen back into
+        # the schedule, None while it is not held there
+        self.jail_release = None
+
+    @property
+    def jail_sentence(self):
+        """
+        Steps left to serve; counted down by advance, or derived from the
+        release step while the model's jail holds the citizen.
+        """
+        if self.jail_release is None:
+            return self._jail_sentence
+        return self.jail_release - self.model.schedule.steps
+
+    @jail_sentence.setter
+    def jail_sentence(self, sentence):
+        self._jail_sentence = sentence
 
     def step(self):
         """
@@ -185,8 +219,11 @@ class Citizen(RandomWalker):
         if self.jail_sentence > 0 or self.condition == "Jailed":
             return
 
-        # update neighborhood
-        self.neighborhood = self.update_neighbors()
+        # update neighborhood, unless the model's influence fields stand in
+        if self.model.influence is None:
+            self.neighborhood = self.update_neighbors()
+        else:
+            self.neighborhood = None
         # based on neighborhood determine if support, oppose, or protest
         self.determine_condition()
 
@@ -199,12 +236,20 @@ class Citizen(RandomWalker):
             self.jail_sentence -= 1
             return
         elif self.jail_sentence <= 0 and self.condition == "Jailed":
-            self.pos = self.random.choice(list(self.model.grid.empties))
+            # sorted so the draw does not depend on the set's insertion history
+            self.pos = self.model.grid.choose_empty(
+                self.rng("release"), ordered=self.model.streams is not None
+            )
             self.model.grid.place_agent(self, self.pos)
             self.condition = "Support"
+            if self.model.events is not None:
+                self.model.events.release(self)
 
         # update condition
-        self.condition = self._update_condition
+        if self.condition != self._update_condition:
+            self.condition = self._update_condition
+            if self.model.events is not None:
+                self.model.events.condition(self)
 
         # memorize avg location of acitve agents
         self.memory = self.determine_avg_loc()
@@ -216,34 +261,44 @@ class Citizen(RandomWalker):
         """
         Look around and see who my neighbors are
         """
-        self.neighborhood = self.model.grid.get_neighborhood(
+        self.neighbors = self.model.grid.get_neighborhood_contents(
             self.pos, moore=True, radius=self.vision
         )
 
-        self.neighbors = self.model.grid.get_cell_list_contents(self.neighborhood)
-
     def determine_condition(self):
         """
         activation function that determines whether citizen will support
         or protest.
         """
-        # Count total active agents in vision
-        actives_in_vision = 0
-        actives_in_vision += sum(
-            [
-                True
-                for active in self.neighbors
-                if isinstance(active, Citizen) and active.condition == "Protest"
-            ]
-        )
-        security_in_vision = 1
-        security_in_vision += sum(
-            [True for active in self.neighbors if isinstance(active, Security)]
-        )
+        if self.model.influence is not None:
+            # kernel weighted pressure from the model's influence fields
+            x, y = self.pos
+            actives_in_vision = self.model.protest_pressure[x][y]
+            security_in_vision = 1 + self.model.security_pressure[x][y]
+        else:
+            # Count total active agents in vision
+            actives_in_vision = 0
+            actives_in_vision += sum(
+                [
+                    True
+                    for active in self.neighbors
+                    if isinstance(active, Citizen) and active.condition == "Protest"
+                ]
+            )
+            security_in_vision = 1
+            security_in_vision += sum(
+                [True for active in self.neighbors if isinstance(active, Security)]
+            )
+
+        # protesting network contacts, counted for all citizens at once
+        actives_in_network = 0
+        if self.network_index is not None:
+            actives_in_network = self.model.network_exposure[self.network_index]
 
         # Calculate opinion and determine condition
         self.opinion = -1 * self.private_preference + (
-            (actives_in_vision) / security_in_vision
+            (actives_in_vision + self.model.network_discount * actives_in_network)
+            / security_in_vision
         )
 
         self.activation = self.model.sigmoid(self.opinion)
@@ -252,6 +307,8 @@ class Citizen(RandomWalker):
             if self._update_condition != "Protest":
                 self.flip = True
                 self.ever_flipped = True
+                if self.model.events is not None:
+                    self.model.events.flip(self)
             self._update_condition = "Protest"
         else:
             self._update_condition = "Support"
@@ -284,6 +341,9 @@ class Security(RandomWalker):
         # random movement
         self.update_neighbors()
         self._new_identity = self.defect()
+        if self._new_identity is not None and self.model.defection == "convert":
+            # swapped for the new identity in the schedule's commit phase
+            self.model.schedule.defer(self.remove_thyself)
 
     def advance(self):
         """
@@ -299,20 +359,22 @@ class Security(RandomWalker):
         """
         Arrests active neighbor
         """
-        neighbor_cells = self.model.grid.get_neighborhood(self.pos, moore=True)
-
         active_neighbors = [
             agent
-            for agent in self.model.grid.get_cell_list_contents(neighbor_cells)
+            for agent in self.model.grid.get_neighborhood_contents(self.pos, moore=True)
             if (isinstance(agent, Citizen) and agent.condition == "Protest")
         ]
 
         if active_neighbors:
-            arrestee = self.random.choice(active_neighbors)
-            sentence = self.random.randint(0, self.model.max_jail_term)
+            arrestee = self.rng("arrest").choice(active_neighbors)
+            sentence = self.rng("arrest").randint(0, self.model.max_jail_term)
             arrestee.jail_sentence = sentence
             arrestee.condition = "Jailed"
             self.model.grid.remove_agent(arrestee)
+            if self.model.jail is not None:
+                self.model.jail.admit(arrestee, sentence)
+            if self.model.events is not None:
+                self.model.events.arrest(arrestee, sentence)
 
     def defect(self):
         """
@@ -330,12 +392,12 @@ class Security(RandomWalker):
         ):
             
             # normal distribution of private regime preference
-            private_preference = self.model.random.gauss(
+            private_preference = self.rng("defect").gauss(
                 self.model.private_preference_distribution_mean,
                 self.model.standard_deviation,
             )
             # uniform distribution of error term on expectation of repression
-            epsilon = self.random.gauss(0, self.model.epsilon)
+            epsilon = self.rng("defect").gauss(0, self.model.epsilon)
             # uniform distribution of threshold for protest
             threshold = self.model.sigmoid(self.model.threshold + epsilon)
 
@@ -349,15 +411,22 @@ class Security(RandomWalker):
                 threshold,
             )
             citizen.condition = "Protest"
-            self.defected = True
+            if not self.defected:
+                self.defected = True
+                self.model.defection_count += 1
+                if self.model.events is not None:
+                    self.model.events.defect(self)
             return citizen
 
     def remove_thyself(self):
         """
-        Removes agent from the grid
+        Replaces the agent on the grid and in the schedule by its new Citizen
+        identity.
         """
         self.model.grid.remove_agent(self)
         self.model.schedule.remove(self)
 
         self.model.grid.place_agent(self._new_identity, self._new_identity.pos)
         self.model.schedule.add(self._new_identity)
+        if self.model.events is not None:
+            self.model.events.convert(self._new_identity)
@@ -0,0 +1,171 @@
+"""
+Streaming, out-of-core analysis of sweep outputs.
+
+Walks the per-run CSVs written by a sweep (data/model/seed_*/model_*.csv and
+the matching data/agent/seed_*/agent_*.csv), reads each one in chunks and
+computes the standard cascade metrics in a single pass, so memory stays flat
+no matter how long the runs or how large the agent files are. Files are
+processed in parallel and the result is one row per run:
+
+    peak_protest           maximum "Protest Count"
+    peak_step              first step at which the peak was reached
+    final_speed_of_spread  "Speed of Spread" at the last step
+    cumulative_flips       number of Support -> Protest flips over the run
+    defections             security agents defected by the last step
+
+Cumulative flips are counted from the agent file when it holds every agent at
+every step, otherwise from the model series (Speed of Spread x Citizen Count).
+
+Usage:
+    $ python -m protest_cascade.analysis data -o data/summary.csv --workers 8
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+RUN_FILE = re.compile(
+    r"model_seed_(?P<seed>[^_]+)_pp_(?P<private_preference>[^_]+)"
+    r"_sd(?P<security_density>[^_]+)_ep_(?P<epsilon>[^_]+)(?:_.+)?\.csv$"
+)
+
+SUMMARY_COLUMNS = [
+    "run",
+    "seed",
+    "private_preference",
+    "security_density",
+    "epsilon",
+    "steps",
+    "peak_protest",
+    "peak_step",
+    "final_speed_of_spread",
+    "cumulative_flips",
+    "defections",
+]
+
+
+def find_runs(root):
+    """
+    Find the per-run model files under root, with their parameter point.
+    """
+    runs = []
+    pattern = os.path.join(root, "**", "model_seed_*.csv")
+    for path in sorted(glob.glob(pattern, recursive=True)):
+        match = RUN_FILE.search(os.path.basename(path))
+        if match is None:
+            continue
+        point = {
+            "run": os.path.basename(path)[len("model_") : -len(".csv")],
+            "seed": int(match["seed"]),
+            "private_preference": float(match["private_preference"]),
+            "security_density": float(match["security_density"]),
+            "epsilon": float(match["epsilon"]),
+        }
+        runs.append((path, point))
+    return runs
+
+
+def agent_file_for(model_path):
+    """
+    Path of the agent file written alongside a model file.
+    """
+    directory, name = os.path.split(model_path)
+    model_root, seed_dir = os.path.split(directory)
+    return os.path.join(
+        os.path.dirname(model_root), "agent", seed_dir, "agent" + name[len("model") :]
+    )
+
+
+def _is_complete(agent_path):
+    """
+    Whether an agent file holds every agent at every step.
+    """
+    sampling_path = agent_path[: -len(".csv")] + ".sampling.json"
+    if not os.path.exists(sampling_path):
+        return True
+    with open(sampling_path) as f:
+        sampling = json.load(f)
+    return all(group.get("policy") == "every_step" for group in sampling.values())
+
+
+def summarize_run(model_path, point, chunksize=100_000):
+    """
+    Compute the cascade metrics of one run in a single streaming pass.
+    """
+    peak_protest = -math.inf
+    peak_step = None
+    speed = math.nan
+    defections = math.nan
+    model_flips = 0.0
+    steps = 0
+
+    for chunk in pd.read_csv(model_path, index_col=0, chunksize=chunksize):
+        protest = chunk["Protest Count"]
+        chunk_peak = protest.max()
+        if chunk_peak > peak_protest:
+            peak_protest = chunk_peak
+            peak_step = int(protest.idxmax())
+        model_flips += (chunk["Speed of Spread"] * chunk["Citizen Count"]).sum()
+        speed = chunk["Speed of Spread"].iloc[-1]
+        if "Defection Count" in chunk:
+            defections = chunk["Defection Count"].iloc[-1]
+        steps = int(chunk.index[-1])
+
+    flips = round(model_flips)
+    agent_path = agent_file_for(model_path)
+    if os.path.exists(agent_path) and _is_complete(agent_path):
+        flips = 0
+        for chunk in pd.read_csv(agent_path, usecols=["flip"], chunksize=chunksize):
+            flips += int((chunk["flip"].astype(str) == "True").sum())
+
+    return {
+        **point,
+        "steps": steps,
+        "peak_protest": peak_protest,
+        "peak_step": peak_step,
+        "final_speed_of_spread": speed,
+        "cumulative_flips": flips,
+        "defections": defections,
+    }
+
+
+def _summarize(args):
+    return summarize_run(*args)
+
+
+def summarize(root, workers=None, chunksize=100_000):
+    """
+    Summarize every run under root into one DataFrame, one row per run.
+    """
+    runs = find_runs(root)
+    jobs = [(path, point, chunksize) for path, point in runs]
+    if workers == 1:
+        rows = list(map(_summarize, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows = list(pool.map(_summarize, jobs, chunksize=4))
+    summary = pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+    return summary.sort_values(SUMMARY_COLUMNS[:5]).reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("root", help="sweep output directory, e.g. data")
+    parser.add_argument("-o", "--output", default=None, help="summary CSV path")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunksize", type=int, default=100_000)
+    args = parser.parse_args(argv)
+
+    summary = summarize(args.root, workers=args.workers, chunksize=args.chunksize)
+    output = args.output or os.path.join(args.root, "summary.csv")
+    summary.to_csv(output, index=False)
+    print(f"Summarized {len(summary)} runs into {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Consistency checks of a run's outputs against the model that wrote them.
+
+    eventlog    one DEFECT record per defection (and one CONVERT record per
+                conversion with defection="convert"), and replaying the log
+                to the last step gives the type, position, condition and
+                defection of every agent
+    trajectory  a run to completion with the default capacity keeps every
+                step, and the last row matches the model's final state
+    headless    mesa.__version__ resolves after the headless start, to the
+                version the full import gives
+
+Each check runs a short model with the outputs it covers written to a
+temporary directory, under both defection modes where they matter, and fails
+on the first mismatch. The headless check runs in fresh interpreters, since
+the headless start only works before anything has imported mesa.
+
+Usage:
+    $ python -m protest_cascade.checks
+    $ python -m protest_cascade.checks --checks eventlog --steps 100
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from .agent import CONDITION_CODES, Security
+from .eventlog import CONVERT, DEFECT, EventLogReader
+from .model import ProtestCascade
+from .trajectory import TrajectoryStore
+
+# arrests and defections are common, so the outputs record both
+BASE_PARAMETERS = dict(
+    seed=1,
+    citizen_density=0.7,
+    security_density=0.06,
+    private_preference_distribution_mean=-2,
+    multiple_agents_per_cell=False,
+)
+
+
+def check_eventlog(directory, steps):
+    """
+    Event log against the model, under both defection modes.
+    """
+    results = []
+    for defection in ("freeze", "convert"):
+        path = os.path.join(directory, f"{defection}.events")
+        model = ProtestCascade(**BASE_PARAMETERS, defection=defection, event_log=path)
+        for _ in range(steps):
+            model.step()
+        model.close()
+
+        reader = EventLogReader(path)
+        conversions = model.defection_count if defection == "convert" else 0
+        problems = []
+        if reader.count(DEFECT) != model.defection_count:
+            problems.append(
+                f"{reader.count(DEFECT)} DEFECT records for "
+                f"{model.defection_count} defections"
+            )
+        if reader.count(CONVERT) != conversions:
+            problems.append(
+                f"{reader.count(CONVERT)} CONVERT records for {conversions} conversions"
+            )
+        state = reader.state_at(model.schedule.steps)
+        for agent in model.schedule.agents:
+            replayed = state.get(agent.unique_id)
+            expected = (
+                type(agent).__name__,
+                agent.pos,
+                agent.condition,
+                isinstance(agent, Security) and agent.defected,
+            )
+            if replayed is None or expected != (
+                replayed.agent_type,
+                replayed.pos,
+                replayed.condition,
+                replayed.defected,
+            ):
+                problems.append(f"agent {agent.unique_id} replays as {replayed}")
+                break
+        results.append(
+            dict(
+                check="eventlog",
+                case=f"defection={defection}",
+                detail="; ".join(problems)
+                or f"{model.defection_count} defections replayed",
+                passed=not problems,
+            )
+        )
+    return results
+
+
+def check_trajectory(directory, steps):
+    """
+    Trajectory store of a run stepped until it stops, with the default
+    capacity derived from max_iters.
+    """
+    path = os.path.join(directory, "trajectory")
+    model = ProtestCascade(**BASE_PARAMETERS, max_iters=steps, trajectory=path)
+    while model.running:
+        model.step()
+    model.close()
+
+    store = TrajectoryStore(path)
+    last = model.schedule.steps
+    problems = []
+    if store.steps != last + 1:
+        problems.append(f"{store.steps} steps stored for steps 0 to {last}")
+    else:
+        row = store.step(last)
+        for agent in model.schedule.agents:
+            column = store.columns[agent.unique_id]
+            x, y = agent.pos if agent.pos is not None else (-1, -1)
+            stored = (row["x"][column], row["y"][column], row["condition"][column])
+            if stored != (x, y, CONDITION_CODES[agent.condition]):
+                problems.append(f"agent {agent.unique_id} stored as {stored} at {last}")
+                break
+    return [
+        dict(
+            check="trajectory",
+            case=f"max_iters={steps}",
+            detail="; ".join(problems) or f"steps 0 to {last} stored",
+            passed=not problems,
+        )
+    ]
+
+
+def check_headless(directory, steps):
+    """
+    mesa.__version__ in fresh interpreters, with and without the headless
+    start.
+    """
+    statements = {
+        "full": "import mesa; print(mesa.__version__)",
+        "headless": (
+            "from protest_cascade.headless import headless_mesa; "
+            "print(headless_mesa().__version__)"
+        ),
+    }
+    versions = {}
+    for name, statement in statements.items():
+        process = subprocess.run(
+            [sys.executable, "-c", statement], capture_output=True, text=True
+        )
+        versions[name] = (
+            process.stdout.strip()
+            if process.returncode == 0
+            else process.stderr.strip().splitlines()[-1]
+        )
+    passed = versions["headless"] == versions["full"]
+    return [
+        dict(
+            check="headless",
+            case="mesa.__version__",
+            detail=versions["headless"]
+            if passed
+            else f"{versions['headless']} headless, {versions['full']} full",
+            passed=passed,
+        )
+    ]
+
+
+CHECKS = {
+    "eventlog": check_eventlog,
+    "trajectory": check_trajectory,
+    "headless": check_headless,
+}
+
+
+def check(names=tuple(CHECKS), steps=60):
+    """
+    Run the named checks; returns one result dict per case.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name in names:
+            results.extend(CHECKS[name](directory, steps))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--checks", nargs="+", choices=list(CHECKS), default=list(CHECKS)
+    )
+    parser.add_argument("--steps", type=int, default=60)
+    parser.add_argument("-o", "--output", default=None, help="JSON report path")
+    args = parser.parse_args(argv)
+
+    results = check(args.checks, args.steps)
+    for result in results:
+        status = "ok" if result["passed"] else "FAIL"
+        print(f"{status:4} {result['check']:10} {result['case']:20} {result['detail']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0 if all(result["passed"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
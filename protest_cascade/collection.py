@@ -0,0 +1,453 @@
+"""
+Sampled and decimated agent-level data collection.
+
+Agent reporters are split into named groups and each group is given a
+CollectionPolicy that decides at which steps and for which agents a record is
+written. Model reporters are still collected at every step.
+
+Model reporters that count agents by an attribute value read an AgentTally
+instead of each walking the agents: the tally reads every attribute any
+reporter asked for in one pass per agent type, and keeps the counts until it
+is invalidated, so the collector, ProtestCascade.step and the server's text
+elements share one evaluation per step. TallyReporter makes such a reporter.
+
+Example:
+>>> collector = SampledDataCollector(
+...     model_reporters={"Protest Count": ProtestCascade.count_protest},
+...     agent_groups={
+...         "state": ({"condition": "condition"}, EveryKSteps(10)),
+...         "traits": ({"threshold": "threshold"}, SnapshotSteps([0])),
+...     },
+... )
+"""
+import copy
+import itertools
+import random
+from collections import Counter
+from operator import attrgetter
+
+import mesa
+import pandas as pd
+
+
+class CollectionPolicy:
+    """
+    Base policy, records every agent at every step.
+
+    Subclasses override wants_step and/or select and extend metadata.
+    """
+
+    name = "every_step"
+
+    def wants_step(self, step):
+        """
+        Whether anything should be recorded at this step.
+        """
+        return True
+
+    def select(self, step, agents, records):
+        """
+        Filter the (agent, record) pairs to keep at this step.
+
+        records holds the reporter values for each agent, in the same order.
+        """
+        return zip(agents, records)
+
+    def needs_records(self):
+        """
+        Whether select needs the reporter values of every candidate agent.
+        """
+        return False
+
+    def metadata(self):
+        """
+        Describe the policy so downstream code knows what was sampled.
+        """
+        return {"policy": self.name}
+
+
+class EveryStep(CollectionPolicy):
+    """
+    Record every agent at every step; the mesa DataCollector behaviour.
+    """
+
+
+class EveryKSteps(CollectionPolicy):
+    """
+    Record every agent at every k-th step, starting at offset.
+    """
+
+    name = "every_k_steps"
+
+    def __init__(self, k, offset=0):
+        if k < 1:
+            raise ValueError("k must be a positive integer")
+        self.k = k
+        self.offset = offset
+
+    def wants_step(self, step):
+        return step >= self.offset and (step - self.offset) % self.k == 0
+
+    def metadata(self):
+        return {"policy": self.name, "k": self.k, "offset": self.offset}
+
+
+class SnapshotSteps(CollectionPolicy):
+    """
+    Record every agent only at the chosen steps.
+    """
+
+    name = "snapshot_steps"
+
+    def __init__(self, steps):
+        self.steps = sorted(set(steps))
+        self._steps = frozenset(self.steps)
+
+    def wants_step(self, step):
+        return step in self._steps
+
+    def metadata(self):
+        return {"policy": self.name, "steps": self.steps}
+
+
+class AgentSubset(CollectionPolicy):
+    """
+    Record a fixed random subset of agent ids at every step (or at the steps
+    of an inner policy).
+
+    size: number of agents to keep, or a fraction if a float below 1
+    seed: seed of the subset draw, independent of the model's random stream
+    within: optional policy deciding the steps, defaults to every step
+
+    The subset is drawn once from the agents present at the first collected
+    step. Agent ids are stable across defection, so a defected Security agent
+    keeps being followed as a Citizen.
+    """
+
+    name = "agent_subset"
+
+    def __init__(self, size, seed=0, within=None):
+        self.size = size
+        self.seed = seed
+        self.within = within if within is not None else EveryStep()
+        self.agent_ids = None
+
+    def wants_step(self, step):
+        return self.within.wants_step(step)
+
+    def select(self, step, agents, records):
+        if self.agent_ids is None:
+            agents = list(agents)
+            ids = sorted(agent.unique_id for agent in agents)
+            size = self.size
+            if isinstance(size, float) and size < 1:
+                size = round(size * len(ids))
+            self.agent_ids = frozenset(
+                random.Random(self.seed).sample(ids, min(size, len(ids)))
+            )
+        return (
+            (agent, record)
+            for agent, record in zip(agents, records)
+            if agent.unique_id in self.agent_ids
+        )
+
+    def metadata(self):
+        return {
+            "policy": self.name,
+            "size": self.size,
+            "seed": self.seed,
+            "within": self.within.metadata(),
+            "agent_ids": sorted(self.agent_ids) if self.agent_ids else [],
+        }
+
+
+class OnStateChange(CollectionPolicy):
+    """
+    Record an agent only when one of the watched reporters changed since the
+    last record of that agent. Every agent is recorded the first time it is
+    seen, so the full state can be rebuilt by carrying values forward.
+
+    watch: names of the group's reporters to compare, all of them if None
+    """
+
+    name = "on_state_change"
+
+    def __init__(self, watch=None):
+        self.watch = list(watch) if watch is not None else None
+        self._columns = None
+        self._last = {}
+
+    def needs_records(self):
+        return True
+
+    def bind(self, reporter_names):
+        """
+        Resolve the watched reporter names to record columns.
+        """
+        names = list(reporter_names)
+        watch = self.watch if self.watch is not None else names
+        self._columns = [names.index(name) for name in watch]
+
+    def select(self, step, agents, records):
+        last = self._last
+        columns = self._columns
+        for agent, record in zip(agents, records):
+            state = tuple(record[i] for i in columns)
+            if last.get(agent.unique_id, self) != state:
+                last[agent.unique_id] = state
+                yield agent, record
+
+    def metadata(self):
+        return {"policy": self.name, "watch": self.watch}
+
+
+class AgentGroup:
+    """
+    A named set of agent reporters collected under one policy.
+
+    The policy is copied so that policies holding state (the drawn subset,
+    the last recorded values) can be shared between runs of a batch.
+    """
+
+    def __init__(self, name, reporters, policy=None):
+        self.name = name
+        self.reporters = dict(reporters)
+        self.policy = copy.deepcopy(policy) if policy is not None else EveryStep()
+        self.records = {}
+        self.rows = 0
+        if isinstance(self.policy, OnStateChange):
+            self.policy.bind(self.reporters)
+        self._functions = [
+            _reporter_function(reporter) for reporter in self.reporters.values()
+        ]
+
+    def collect(self, step, agents):
+        """
+        Record the agents chosen by the policy at this step.
+        """
+        if not self.policy.wants_step(step):
+            return
+        functions = self._functions
+        if self.policy.needs_records():
+            records = [tuple(f(agent) for f in functions) for agent in agents]
+            chosen = self.policy.select(step, agents, records)
+            rows = [(step, agent.unique_id) + record for agent, record in chosen]
+        else:
+            chosen = self.policy.select(step, agents, itertools.repeat(None))
+            rows = [
+                (step, agent.unique_id) + tuple(f(agent) for f in functions)
+                for agent, _ in chosen
+            ]
+        # a step collected again replaces its rows
+        self.rows += len(rows) - len(self.records.get(step, ()))
+        self.records[step] = rows
+
+    def metadata(self):
+        """
+        Policy description plus what was actually recorded.
+        """
+        return {
+            **self.policy.metadata(),
+            "reporters": list(self.reporters),
+            "collected_steps": [step for step, rows in self.records.items() if rows],
+            "records": sum(len(rows) for rows in self.records.values()),
+        }
+
+    def dataframe(self):
+        """
+        Records as a DataFrame indexed by (Step, AgentID).
+        """
+        df = pd.DataFrame.from_records(
+            data=itertools.chain.from_iterable(self.records.values()),
+            columns=["Step", "AgentID"] + list(self.reporters),
+        )
+        return df.set_index(["Step", "AgentID"])
+
+
+def _reporter_function(reporter):
+    """
+    Turn an attribute name into a getter that tolerates missing attributes.
+    """
+    if isinstance(reporter, str):
+        return lambda agent: getattr(agent, reporter, None)
+    return reporter
+
+
+class SampledDataCollector(mesa.DataCollector):
+    """
+    DataCollector that collects model reporters every step and agent reporter
+    groups according to their CollectionPolicy.
+
+    agent_groups: mapping of group name to (reporters, policy)
+    agent_reporters: plain mesa style reporters, collected as one group named
+                     "agents" at every step
+
+    get_agent_vars_dataframe(group) returns one group; without a group the
+    groups are joined on (Step, AgentID). The sampling metadata is attached to
+    the returned frame as df.attrs["sampling"] and is available from
+    sampling_metadata().
+    """
+
+    def __init__(
+        self, model_reporters=None, agent_reporters=None, tables=None, agent_groups=None
+    ):
+        super().__init__(model_reporters=model_reporters, tables=tables)
+        self.agent_groups = {}
+        if agent_reporters:
+            self.agent_groups["agents"] = AgentGroup("agents", agent_reporters)
+        for name, (reporters, policy) in (agent_groups or {}).items():
+            self.agent_groups[name] = AgentGroup(name, reporters, policy)
+        for group in self.agent_groups.values():
+            self.agent_reporters.update(group.reporters)
+
+    def collect(self, model):
+        """
+        Collect all model reporters, then each agent group per its policy.
+        """
+        agent_reporters, self.agent_reporters = self.agent_reporters, {}
+        try:
+            super().collect(model)
+        finally:
+            self.agent_reporters = agent_reporters
+
+        if self.agent_groups:
+            step = model.schedule.steps
+            agents = model.schedule.agents
+            for group in self.agent_groups.values():
+                group.collect(step, agents)
+
+    def buffered_rows(self):
+        """
+        Rows held in memory: model rows plus every agent group's records.
+        """
+        model_rows = max((len(v) for v in self.model_vars.values()), default=0)
+        return model_rows + sum(group.rows for group in self.agent_groups.values())
+
+    def sampling_metadata(self):
+        """
+        Per group description of the policy and of what was recorded.
+        """
+        return {name: group.metadata() for name, group in self.agent_groups.items()}
+
+    def get_agent_vars_dataframe(self, group=None):
+        """
+        Create a DataFrame of one agent group, or of all groups joined.
+        """
+        if group is not None:
+            df = self.agent_groups[group].dataframe()
+        elif len(self.agent_groups) == 1:
+            df = next(iter(self.agent_groups.values())).dataframe()
+        else:
+            frames = [g.dataframe() for g in self.agent_groups.values()]
+            df = pd.concat(frames, axis=1, join="outer").sort_index()
+        df.attrs["sampling"] = self.sampling_metadata()
+        return df
+
+
+class AgentTally:
+    """
+    Counts of agent attribute values, computed in one pass per agent type
+    and cached until invalidate() is called.
+
+    agents_of: function returning the agents of an agent type
+    """
+
+    def __init__(self, agents_of):
+        self.agents_of = agents_of
+        self._attributes = {}
+        self._counts = None
+        self.passes = 0
+
+    def register(self, agent_type, attribute):
+        """
+        Add an attribute to the fused pass over agent_type.
+        """
+        attributes = self._attributes.setdefault(agent_type, [])
+        if attribute not in attributes:
+            attributes.append(attribute)
+            self._counts = None
+
+    def invalidate(self):
+        """
+        Drop the cached counts, e.g. after agents changed state.
+        """
+        self._counts = None
+
+    def count(self, agent_type, attribute, value):
+        """
+        Number of agents of agent_type whose attribute equals value.
+        """
+        if attribute not in self._attributes.get(agent_type, ()):
+            self.register(agent_type, attribute)
+        if self._counts is None:
+            self._tally()
+        index = self._attributes[agent_type].index(attribute)
+        return sum(
+            count
+            for key, count in self._counts[agent_type].items()
+            if key[index] == value
+        )
+
+    def _tally(self):
+        counts = {}
+        for agent_type, attributes in self._attributes.items():
+            # one tuple of every registered attribute per agent
+            getter = attrgetter(*attributes)
+            values = map(getter, self.agents_of(agent_type))
+            if len(attributes) == 1:
+                values = zip(values)
+            counts[agent_type] = Counter(values)
+        self._counts = counts
+        self.passes += 1
+
+
+class TallyReporter:
+    """
+    Model reporter counting the agents of a type whose attribute equals
+    value, from the model's AgentTally; transform(model, count) optionally
+    turns the count into the reported value. Custom reporters built this way
+    join the same fused pass.
+
+    Example:
+    >>> TallyReporter(Citizen, "condition", "Protest")
+    >>> TallyReporter(Citizen, "flip", True, lambda m, n: n / m.citizen_count)
+    """
+
+    def __init__(self, agent_type, attribute, value, transform=None):
+        self.agent_type = agent_type
+        self.attribute = attribute
+        self.value = value
+        self.transform = transform
+
+    def __call__(self, model):
+        count = model.tally.count(self.agent_type, self.attribute, self.value)
+        if self.transform is not None:
+            return self.transform(model, count)
+        return count
+
+
+POLICIES = {
+    policy.name: policy
+    for policy in (EveryStep, EveryKSteps, SnapshotSteps, AgentSubset, OnStateChange)
+}
+
+
+def policy_from_spec(spec):
+    """
+    Build a policy from a JSON friendly spec, so sweep grid files can set
+    agent_collection. A spec is a policy name or a one item mapping of name to
+    keyword arguments, e.g. {"every_k_steps": {"k": 10}} or
+    {"agent_subset": {"size": 50, "within": {"every_k_steps": {"k": 5}}}}.
+    A mapping of reporter group names to specs gives a mapping of policies.
+    """
+    if spec is None or isinstance(spec, CollectionPolicy):
+        return spec
+    if isinstance(spec, str):
+        return POLICIES[spec]()
+    if len(spec) == 1 and next(iter(spec)) in POLICIES:
+        name, kwargs = next(iter(spec.items()))
+        kwargs = dict(kwargs)
+        if "within" in kwargs:
+            kwargs["within"] = policy_from_spec(kwargs["within"])
+        return POLICIES[name](**kwargs)
+    return {group: policy_from_spec(policy) for group, policy in spec.items()}
@@ -0,0 +1,302 @@
+"""
+Append-only binary event log of state transitions, with a replay reader.
+
+Instead of full agent snapshots every step, the writer records only what
+changed, as fixed-width little-endian records (EVENT_DTYPE, 18 bytes each):
+
+    step    uint32  model step at which the change is visible
+    kind    uint8   one of the event kinds below
+    code    uint8   condition code (see agent.CONDITIONS)
+    x, y    int16   position, -1 when the agent is off the grid
+    agent   uint32  unique_id of the agent
+    value   int32   jail sentence for ARREST and citizen keyframe records,
+                    1 for security keyframe records of defected agents, else 0
+
+A keyframe (a KEYFRAME marker followed by one record per agent) is written at
+step 0 and every keyframe_interval steps, so the reader can rebuild the state
+at any step from the nearest earlier keyframe plus the events after it.
+
+A DEFECT record is written when a security agent defects, in every defection
+mode; with defection="convert" a CONVERT record follows when the commit phase
+swaps it for its Citizen identity.
+
+Example:
+>>> model = ProtestCascade(seed=1, event_log="run.events")
+>>> for _ in range(100):
+...     model.step()
+>>> model.events.close()
+>>> state = EventLogReader("run.events").state_at(37)
+"""
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from .agent import CONDITION_CODES, CONDITIONS, Security
+
+MAGIC = b"PCEV"
+VERSION = 2
+HEADER = struct.Struct("<4sHHHH")
+
+EVENT = struct.Struct("<IBBhhIi")
+EVENT_DTYPE = np.dtype(
+    [
+        ("step", "<u4"),
+        ("kind", "u1"),
+        ("code", "u1"),
+        ("x", "<i2"),
+        ("y", "<i2"),
+        ("agent", "<u4"),
+        ("value", "<i4"),
+    ]
+)
+
+# event kinds
+KEYFRAME = 0
+KEY_CITIZEN = 1
+KEY_SECURITY = 2
+MOVE = 3
+FLIP = 4
+CONDITION = 5
+ARREST = 6
+RELEASE = 7
+DEFECT = 8
+CONVERT = 9
+
+AgentState = namedtuple(
+    "AgentState",
+    ["agent_type", "pos", "condition", "jail_sentence", "flip", "defected"],
+    defaults=(False,),
+)
+
+
+class EventLogWriter:
+    """
+    Buffer events of the current step and append them to the log file.
+
+    path: file to write, truncated if it exists
+    width, height: grid dimensions stored in the header
+    keyframe_interval: steps between full keyframes
+    """
+
+    def __init__(self, path, width, height, keyframe_interval=50):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.step = 0
+        self._buffer = bytearray()
+        self._pack = EVENT.pack
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, VERSION, EVENT.size, width, height))
+
+    def begin_step(self, step):
+        """
+        Stamp subsequent events with the step at which they become visible.
+        """
+        self.step = step
+
+    def _append(self, kind, agent, value=0):
+        pos = agent.pos
+        x, y = pos if pos is not None else (-1, -1)
+        self._buffer += self._pack(
+            self.step,
+            kind,
+            CONDITION_CODES.get(agent.condition, 0),
+            x,
+            y,
+            agent.unique_id,
+            value,
+        )
+
+    def move(self, agent):
+        """
+        Agent moved to agent.pos.
+        """
+        self._append(MOVE, agent)
+
+    def flip(self, agent):
+        """
+        Citizen decided to switch from Support to Protest.
+        """
+        self._buffer += self._pack(
+            self.step, FLIP, CONDITION_CODES["Protest"], -1, -1, agent.unique_id, 0
+        )
+
+    def condition(self, agent):
+        """
+        Agent's condition changed to agent.condition.
+        """
+        self._append(CONDITION, agent)
+
+    def arrest(self, agent, sentence):
+        """
+        Citizen was arrested and taken off the grid for sentence steps.
+        """
+        self._buffer += self._pack(
+            self.step,
+            ARREST,
+            CONDITION_CODES["Jailed"],
+            -1,
+            -1,
+            agent.unique_id,
+            sentence,
+        )
+
+    def release(self, agent):
+        """
+        Citizen was released and relocated to agent.pos.
+        """
+        self._append(RELEASE, agent)
+
+    def defect(self, agent):
+        """
+        Security agent defected; it stops arresting and moving.
+        """
+        self._append(DEFECT, agent)
+
+    def convert(self, agent):
+        """
+        Defected security agent replaced; agent is its new Citizen identity.
+        """
+        self._append(CONVERT, agent)
+
+    def keyframe(self, agents):
+        """
+        Write the full state of agents at the current step.
+        """
+        agents = list(agents)
+        self._buffer += self._pack(self.step, KEYFRAME, 0, -1, -1, 0, len(agents))
+        for agent in agents:
+            if isinstance(agent, Security):
+                self._append(KEY_SECURITY, agent, int(agent.defected))
+            else:
+                self._append(KEY_CITIZEN, agent, agent.jail_sentence)
+
+    def end_step(self, agents):
+        """
+        Write a keyframe if one is due and hand the step's events to the file.
+        """
+        if self.step % self.keyframe_interval == 0:
+            self.keyframe(agents)
+        self.flush()
+
+    def flush(self):
+        """
+        Write buffered events to the file.
+        """
+        if self._buffer:
+            self._file.write(self._buffer)
+            self._buffer.clear()
+        self._file.flush()
+
+    def close(self):
+        """
+        Flush and close the log file.
+        """
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+
+class EventLogReader:
+    """
+    Memory-mapped reader that replays an event log to any step.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, version, record_size, self.width, self.height = HEADER.unpack(
+                f.read(HEADER.size)
+            )
+        if magic != MAGIC or version != VERSION or record_size != EVENT.size:
+            raise ValueError(f"{path} is not a version {VERSION} event log")
+        self.records = np.memmap(path, dtype=EVENT_DTYPE, mode="r", offset=HEADER.size)
+        self.keyframes = np.flatnonzero(self.records["kind"] == KEYFRAME)
+        self.keyframe_steps = self.records["step"][self.keyframes]
+
+    def count(self, kind):
+        """
+        Number of events of a kind in the log.
+        """
+        return int(np.count_nonzero(self.records["kind"] == kind))
+
+    @property
+    def last_step(self):
+        """
+        Last step with recorded events.
+        """
+        return int(self.records["step"][-1]) if len(self.records) else 0
+
+    def state_at(self, step):
+        """
+        Rebuild the state of every agent at step.
+
+        Returns a dict of unique_id to AgentState. jail_sentence is the
+        sentence as of the arrest or the last keyframe, flip is True for
+        citizens that flipped to Protest at exactly this step, and defected is
+        True for security agents that have defected.
+        """
+        k = np.searchsorted(self.keyframe_steps, step, side="right") - 1
+        if k < 0:
+            raise ValueError(f"no keyframe at or before step {step}")
+        start = int(self.keyframes[k])
+        count = int(self.records["value"][start])
+        end = int(np.searchsorted(self.records["step"], step, side="right"))
+
+        state = {}
+        for record in self.records[start + 1 : start + 1 + count].tolist():
+            _, kind, code, x, y, agent, value = record
+            pos = (x, y) if x >= 0 else None
+            if kind == KEY_SECURITY:
+                state[agent] = AgentState(
+                    "Security", pos, CONDITIONS[code], 0, False, bool(value)
+                )
+            else:
+                state[agent] = AgentState(
+                    "Citizen", pos, CONDITIONS[code], value, False
+                )
+
+        for record in self.records[start + 1 + count : end].tolist():
+            _, kind, code, x, y, agent, value = record
+            if kind in (KEYFRAME, KEY_CITIZEN, KEY_SECURITY, FLIP):
+                continue
+            current = state[agent]
+            if kind == MOVE:
+                state[agent] = current._replace(pos=(x, y))
+            elif kind == CONDITION:
+                state[agent] = current._replace(condition=CONDITIONS[code])
+            elif kind == ARREST:
+                state[agent] = current._replace(
+                    pos=None, condition="Jailed", jail_sentence=value
+                )
+            elif kind == RELEASE:
+                state[agent] = current._replace(
+                    pos=(x, y), condition=CONDITIONS[code], jail_sentence=0
+                )
+            elif kind == DEFECT:
+                state[agent] = current._replace(defected=True)
+            elif kind == CONVERT:
+                state[agent] = AgentState("Citizen", (x, y), CONDITIONS[code], 0, False)
+
+        # flips are decided during the step, so they live in that step's block
+        begin = int(np.searchsorted(self.records["step"], step, side="left"))
+        block = self.records[begin:end]
+        for agent in block["agent"][block["kind"] == FLIP].tolist():
+            state[agent] = state[agent]._replace(flip=True)
+        return state
+
+    def grid_at(self, step):
+        """
+        Occupancy of the grid at step as a (width, height, 3) array counting
+        supporting citizens, protesting citizens and security agents per cell.
+        """
+        grid = np.zeros((self.width, self.height, 3), dtype=np.int32)
+        for agent in self.state_at(step).values():
+            if agent.pos is None:
+                continue
+            if agent.agent_type == "Security":
+                layer = 2
+            else:
+                layer = 1 if agent.condition == "Protest" else 0
+            grid[agent.pos[0], agent.pos[1], layer] += 1
+        return grid
@@ -0,0 +1,161 @@
+"""
+Headless fast start: the simulation core without mesa's visualization.
+
+mesa's package __init__ imports its browser visualization (tornado) and
+batch runner along with the simulation core. headless_mesa() registers the
+mesa package without running its __init__, imports only the core modules
+(agent, model, time, space, datacollection) and binds their names on the
+package; any other attribute of mesa (visualization, batch_run, __version__,
+...) runs the real __init__ on first access, so code written against the
+full package keeps working. It has to run before anything else imports
+mesa, and does nothing if something already has. mesa.model itself imports
+pandas through the DataCollector, so pandas still loads; scipy (network runs
+only) and our own pandas exports load on demand.
+
+Sweeps (python -m protest_cascade.sweep) and run_batch.py start headless.
+Single runs for process pools or job arrays:
+
+    $ python -m protest_cascade.headless seed=1 security_density=0.04 --steps 200 -o run.csv
+    $ python -m protest_cascade.headless --cold-start
+
+The first prints the final model reporters as a JSON line and writes the
+model reporters to run.csv; the second measures the import time of the
+model in fresh interpreters, with and without the headless start.
+"""
+import argparse
+import csv
+import importlib
+import importlib.util
+import json
+import subprocess
+import sys
+import time
+
+# mesa modules the simulation needs, in import order
+CORE_MODULES = ("agent", "datacollection", "model", "time", "space")
+
+# module attributes the import system sets and probes; missing ones stay
+# missing instead of loading the package
+IMPORT_ATTRIBUTES = {"__name__", "__loader__", "__package__", "__spec__"}
+IMPORT_ATTRIBUTES |= {"__path__", "__file__", "__cached__", "__builtins__"}
+
+
+def headless_mesa():
+    """
+    Import mesa's simulation core without its package __init__; returns the
+    mesa package.
+    """
+    if "mesa" in sys.modules:
+        return sys.modules["mesa"]
+    spec = importlib.util.find_spec("mesa")
+    package = importlib.util.module_from_spec(spec)
+
+    def __getattr__(name):
+        if name in IMPORT_ATTRIBUTES:
+            raise AttributeError(name)
+        # the rest of mesa's namespace (__version__ included), from its own
+        # __init__
+        del package.__getattr__
+        spec.loader.exec_module(package)
+        return getattr(package, name)
+
+    package.__getattr__ = __getattr__
+    sys.modules["mesa"] = package
+    try:
+        for name in CORE_MODULES:
+            importlib.import_module(f"mesa.{name}")
+    except BaseException:
+        del sys.modules["mesa"]
+        raise
+    package.Model = package.model.Model
+    package.Agent = package.agent.Agent
+    package.DataCollector = package.datacollection.DataCollector
+    return package
+
+
+def parse_parameter(text):
+    """
+    Model parameter from name=value, value read as JSON where it parses.
+    """
+    name, _, value = text.partition("=")
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+
+def run(parameters, steps=None, output=None):
+    """
+    Run one model to steps (or until it stops), write its model reporters to
+    output as CSV and return the final row.
+    """
+    headless_mesa()
+    from .model import ProtestCascade
+
+    model = ProtestCascade(**parameters)
+    limit = steps if steps is not None else model.max_iters
+    while model.running and model.schedule.steps < limit:
+        model.step()
+    model.close()
+
+    model_vars = model.datacollector.model_vars
+    if output is not None:
+        with open(output, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Step", *model_vars])
+            for step, row in enumerate(zip(*model_vars.values())):
+                writer.writerow([step, *row])
+    final = {name: values[-1] for name, values in model_vars.items()}
+    return {"Steps": model.schedule.steps, **final}
+
+
+def cold_start(repeats=5):
+    """
+    Best wall time of importing the model in a fresh interpreter: bare
+    python, the full mesa package and the headless start.
+    """
+    statements = {
+        "python": "pass",
+        "full": "import mesa, protest_cascade.model",
+        "headless": (
+            "from protest_cascade.headless import headless_mesa; "
+            "headless_mesa(); import protest_cascade.model"
+        ),
+    }
+    times = {}
+    for name, statement in statements.items():
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", statement], check=True)
+            best = min(best, time.perf_counter() - start)
+        times[name] = best
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "parameters", nargs="*", metavar="NAME=VALUE", help="model parameters"
+    )
+    parser.add_argument("--steps", type=int, default=None)
+    parser.add_argument("-o", "--output", default=None, help="model reporters CSV")
+    parser.add_argument(
+        "--cold-start", action="store_true", help="measure import time and exit"
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if args.cold_start:
+        times = cold_start(args.repeats)
+        for name, seconds in times.items():
+            print(f"{name:8} {seconds * 1000:7.0f} ms")
+        return 0
+
+    parameters = dict(parse_parameter(text) for text in args.parameters)
+    print(json.dumps(run(parameters, args.steps, args.output), default=str))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""
+Structured, queue-based logging for interactive runs and batch sweeps.
+
+The simulation thread only creates a log record and puts it on an in-process
+queue; a QueueListener thread merges the message arguments, serializes the
+record to a JSON line and writes it to disk. Level gating happens in the
+logger before any record is built, so hot-path calls must use lazy
+%-style arguments (``log.debug("moved %s", pos)``) rather than f-strings.
+
+Every record is stamped with the current run id and the worker that produced
+it. Sweep workers each write to their own file, see configure_worker_logging.
+"""
+import atexit
+import json
+import logging as log
+import logging.handlers
+import os
+import queue
+
+LOG_LEVEL_ENV = "PROTEST_CASCADE_LOG_LEVEL"
+
+_run_id = None
+_listener = None
+
+
+def set_run_id(run_id):
+    """
+    Set the run id stamped on every subsequent record of this process.
+    """
+    global _run_id
+    _run_id = run_id
+
+
+def get_run_id():
+    """
+    Return the run id currently stamped on records of this process.
+    """
+    return _run_id
+
+
+def resolve_level(level=None):
+    """
+    Resolve a level name or number, letting the environment override it.
+    """
+    level = os.environ.get(LOG_LEVEL_ENV, level)
+    if level is None:
+        return log.INFO
+    if isinstance(level, str):
+        return log.getLevelName(level.upper())
+    return level
+
+
+class RunContextFilter(log.Filter):
+    """
+    Stamp records with the run id and worker name at the time they are made.
+    """
+
+    def filter(self, record):
+        record.run_id = _run_id
+        record.worker = f"{record.processName}-{record.process}"
+        return True
+
+
+class JsonLineFormatter(log.Formatter):
+    """
+    Format a record as a single JSON object per line.
+
+    Anything passed through ``extra={"data": {...}}`` is emitted under "data".
+    """
+
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "worker": getattr(record, "worker", None),
+            "run_id": getattr(record, "run_id", None),
+            "message": record.getMessage(),
+        }
+        data = getattr(record, "data", None)
+        if data is not None:
+            entry["data"] = data
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves message formatting to the listener thread.
+
+    The stock QueueHandler merges args into the message before enqueueing so
+    records can be pickled; our queue never leaves the process, so the record
+    is passed through untouched. Log arguments should therefore be values
+    that do not change after the call (numbers, strings, tuples).
+    """
+
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            record.exc_text = log.Formatter().formatException(record.exc_info)
+        return record
+
+
+def configure_logging(path, level=None, console=False):
+    """
+    Route the root logger through a queue to a JSON lines file at path.
+
+    path: file to write JSON lines to, its directory is created if needed
+    level: minimum level to record, overridden by $PROTEST_CASCADE_LOG_LEVEL
+    console: also echo INFO and above to stderr in plain text
+
+    Any previous configuration made by this module is stopped first. Returns
+    the running QueueListener, which is also stopped at interpreter exit.
+    """
+    global _listener
+    stop_logging()
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    file_handler = log.FileHandler(path, mode="w")
+    file_handler.setFormatter(JsonLineFormatter())
+    handlers = [file_handler]
+    if console:
+        console_handler = log.StreamHandler()
+        console_handler.setLevel(log.INFO)
+        console_handler.setFormatter(log.Formatter("%(message)s"))
+        handlers.append(console_handler)
+
+    records = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(records)
+    queue_handler.addFilter(RunContextFilter())
+
+    root = log.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(resolve_level(level))
+
+    _listener = logging.handlers.QueueListener(
+        records, *handlers, respect_handler_level=True
+    )
+    _listener.start()
+    return _listener
+
+
+def configure_worker_logging(directory, stem="worker", level=None):
+    """
+    Give a sweep worker process its own JSON lines stream in directory.
+
+    Meant to be used as a process pool initializer; the file is named after
+    the stem and the worker's pid so concurrent workers never share a file.
+    """
+    path = os.path.join(directory, f"{stem}.{os.getpid()}.jsonl")
+    return configure_logging(path, level=level)
+
+
+def stop_logging():
+    """
+    Flush and stop the listener thread, if one is running.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop_logging)
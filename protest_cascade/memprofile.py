@@ -0,0 +1,194 @@
+"""
+Opt-in memory profiling of a ProtestCascade run.
+
+With memory_profile set to a step policy (any collection policy, e.g.
+SnapshotSteps([0, 100, 200]) or EveryKSteps(50)) the model starts tracemalloc
+before it builds anything and takes a snapshot at the chosen steps. Every
+traced block is attributed to the innermost frame of its allocation traceback
+that belongs to a known part of the model:
+
+    agents     agent objects and their attributes (agent.py, agent construction)
+    neighbors  neighbor lists built by the grid's neighborhood queries
+    grid       grid cells, empties and stencil tables
+    scheduler  schedule dicts
+    collector  DataCollector storage (model vars and agent records)
+    outputs    event log and trajectory buffers
+    model      other model allocations
+    other      everything else (imports, caller code)
+
+One row per snapshot is kept in MemoryProfiler.records, with the traced
+current and peak bytes and the process's peak RSS, and the model adds the
+"Peak RSS" and "Bytes per Agent" model reporters. Tracing slows a run down
+by a factor of ten to twenty, so keep it off for production sweeps and
+profile single points.
+
+Example:
+>>> model = ProtestCascade(seed=1, memory_profile=SnapshotSteps([0, 50]))
+>>> for _ in range(50): model.step()
+>>> model.close()
+>>> model.memory_profile.dataframe()
+"""
+import inspect
+import linecache
+import logging as log
+import os
+import sys
+import tracemalloc
+
+import pandas as pd
+
+from .metrics import peak_rss_bytes
+from .space import StencilGrid
+
+CATEGORIES = (
+    "agents",
+    "neighbors",
+    "grid",
+    "scheduler",
+    "collector",
+    "outputs",
+    "model",
+    "other",
+)
+
+_PACKAGE = os.path.dirname(os.path.abspath(__file__))
+
+# files of this package and of mesa by category
+_FILES = {
+    "agent.py": "agents",
+    "space.py": "grid",
+    "scheduler.py": "scheduler",
+    "collection.py": "collector",
+    "eventlog.py": "outputs",
+    "trajectory.py": "outputs",
+    "model.py": "model",
+}
+_MESA_FILES = {
+    "agent.py": "agents",
+    "space.py": "grid",
+    "time.py": "scheduler",
+    "datacollection.py": "collector",
+}
+
+
+def _line_range(function):
+    lines, first = inspect.getsourcelines(function)
+    return range(first, first + len(lines))
+
+
+_NEIGHBOR_LINES = _line_range(StencilGrid.get_neighborhood_contents)
+
+
+def categorize(traceback):
+    """
+    Category of an allocation traceback, see the module docstring.
+    """
+    # tracemalloc orders frames from the oldest to the most recent
+    for frame in reversed(traceback):
+        directory, name = os.path.split(frame.filename)
+        if directory == _PACKAGE:
+            category = _FILES.get(name)
+            if category == "grid" and frame.lineno in _NEIGHBOR_LINES:
+                return "neighbors"
+            if category == "model":
+                # agent objects are allocated where they are built, and their
+                # attribute dicts grow where the model sets agent attributes
+                line = linecache.getline(frame.filename, frame.lineno)
+                if "Citizen(" in line or "Security(" in line or "agent." in line:
+                    return "agents"
+            if category is not None:
+                return category
+        elif os.path.basename(directory) == "mesa" and name in _MESA_FILES:
+            return _MESA_FILES[name]
+    return "other"
+
+
+class MemoryProfiler:
+    """
+    Takes tracemalloc snapshots of a run at the steps chosen by a policy.
+
+    policy: a CollectionPolicy; only its wants_step is used
+    frames: traceback depth traced; deeper attributes more blocks to their
+            owner but traces more slowly
+    """
+
+    def __init__(self, policy, frames=4):
+        self.policy = policy
+        self.frames = frames
+        self.records = []
+        self._started = False
+
+    def start(self):
+        """
+        Start tracing, unless something else already traces.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started = True
+
+    def stop(self):
+        """
+        Stop tracing if this profiler started it.
+        """
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+
+    def maybe_snapshot(self, model):
+        if tracemalloc.is_tracing() and self.policy.wants_step(model.schedule.steps):
+            self.snapshot(model)
+
+    def snapshot(self, model):
+        """
+        Record the traced memory of model by category.
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+        by_category = dict.fromkeys(CATEGORIES, 0)
+        for statistic in snapshot.statistics("traceback"):
+            by_category[categorize(statistic.traceback)] += statistic.size
+        current, peak = tracemalloc.get_traced_memory()
+        agents = len(model.schedule.agents)
+        record = {
+            "step": model.schedule.steps,
+            "agent_count": agents,
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "peak_rss_bytes": peak_rss_bytes(),
+            **{f"{category}_bytes": size for category, size in by_category.items()},
+            "bytes_per_agent": (
+                (by_category["agents"] + by_category["neighbors"]) / agents
+                if agents
+                else None
+            ),
+        }
+        self.records.append(record)
+        log.debug("Memory snapshot %s", record)
+        return record
+
+    def dataframe(self):
+        """
+        The snapshots as a DataFrame indexed by step.
+        """
+        return pd.DataFrame(self.records).set_index("step")
+
+
+def agent_bytes(agents):
+    """
+    Shallow size of the agents, their attribute dicts and the neighbor and
+    network lists they hold, divided by their number.
+    """
+    total = 0
+    count = 0
+    getsizeof = sys.getsizeof
+    for agent in agents:
+        count += 1
+        total += getsizeof(agent) + getsizeof(agent.__dict__)
+        neighbors = getattr(agent, "neighbors", None)
+        if neighbors is not None:
+            total += getsizeof(neighbors)
+        network = getattr(agent, "network", None)
+        if network is not None:
+            total += getsizeof(network)
+    return total / count if count else 0
@@ -0,0 +1,354 @@
+"""
+Live metrics of a running sweep, served over local HTTP.
+
+Every process that runs models installs a StepRecorder; ProtestCascade.step
+reports its duration to it, and the recorder keeps per worker counts (runs
+completed, steps, time in step, recent steps per second, peak RSS, rows held
+by the data collector). Snapshots go to a MetricsRegistry, directly when the
+models run in the serving process, or through a multiprocessing queue from
+pool workers at most once per interval.
+
+serve_metrics starts a small HTTP server on a daemon thread:
+
+    /metrics       Prometheus text exposition format
+    /metrics.json  the same values as JSON
+
+Example:
+>>> registry = MetricsRegistry(runs_planned=245)
+>>> server = serve_metrics(registry, port=9100)
+>>> start_recorder(registry)
+$ curl localhost:9100/metrics
+"""
+import json
+import logging as log
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+
+# the recorder of this process, None when metrics are off
+RECORDER = None
+
+PREFIX = "protest_cascade"
+
+
+def peak_rss_bytes():
+    """
+    Peak resident set size of this process.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StepRecorder:
+    """
+    Per process step timings and run counts, published as snapshots.
+
+    sink: a MetricsRegistry, or a queue the registry listens on
+    interval: minimum seconds between published snapshots
+    """
+
+    def __init__(self, sink, worker=None, interval=1.0):
+        self.sink = sink
+        # named like the worker field of the JSON log records
+        self.worker = (
+            worker or f"{multiprocessing.current_process().name}-{os.getpid()}"
+        )
+        self.interval = interval
+        self.runs_completed = 0
+        self.steps = 0
+        self.step_seconds = 0.0
+        self.steps_per_second = 0.0
+        self.collection_rows = 0
+        self._model = None
+        self._window_start = time.monotonic()
+        self._window_steps = 0
+        self._published = 0.0
+
+    def step(self, model, seconds):
+        """
+        Record one ProtestCascade.step of model taking seconds.
+        """
+        if model is not self._model:
+            # the previous run was not closed, count it when the next starts
+            if self._model is not None:
+                self.runs_completed += 1
+            self._model = model
+            # publish right away so the new run shows as running
+            self._published = 0.0
+        self.steps += 1
+        self.step_seconds += seconds
+        self._window_steps += 1
+        now = time.monotonic()
+        if now - self._published >= self.interval:
+            self.collection_rows = model.datacollector.buffered_rows()
+            self.publish(now)
+
+    def run_finished(self, model):
+        """
+        Count model's run as completed.
+        """
+        if model is self._model:
+            self._model = None
+        self.runs_completed += 1
+        self.collection_rows = 0
+        self.publish()
+
+    def finish(self):
+        """
+        Count the run in progress, if any, as completed; for runners that
+        never close their models.
+        """
+        if self._model is not None:
+            self.run_finished(self._model)
+
+    def snapshot(self):
+        return {
+            "worker": self.worker,
+            "runs_completed": self.runs_completed,
+            "steps": self.steps,
+            "step_seconds": self.step_seconds,
+            "steps_per_second": self.steps_per_second,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "collection_rows": self.collection_rows,
+            "running": self._model is not None,
+            "updated": time.time(),
+        }
+
+    def publish(self, now=None):
+        """
+        Send a snapshot to the sink, with the step rate since the last one.
+        """
+        now = time.monotonic() if now is None else now
+        elapsed = now - self._window_start
+        if elapsed > 0:
+            self.steps_per_second = self._window_steps / elapsed
+        self._window_start = now
+        self._window_steps = 0
+        self._published = now
+        if isinstance(self.sink, MetricsRegistry):
+            self.sink.update(self.snapshot())
+        else:
+            self.sink.put(self.snapshot())
+
+
+def start_recorder(sink, worker=None, interval=1.0):
+    """
+    Install the recorder of this process; usable as a pool initializer.
+    """
+    global RECORDER
+    RECORDER = StepRecorder(sink, worker, interval)
+    return RECORDER
+
+
+class MetricsRegistry:
+    """
+    Latest snapshot of every worker plus the sweep totals derived from them.
+
+    runs_planned: number of runs the sweep will make, for runs queued and ETA
+    """
+
+    def __init__(self, runs_planned=0):
+        self.runs_planned = runs_planned
+        self.started = time.time()
+        self.workers = {}
+        self._lock = threading.Lock()
+
+    def update(self, snapshot):
+        with self._lock:
+            self.workers[snapshot["worker"]] = snapshot
+
+    def listen(self, queue):
+        """
+        Apply snapshots arriving on queue from a daemon thread.
+        """
+
+        def drain():
+            while True:
+                try:
+                    snapshot = queue.get()
+                except (EOFError, OSError):
+                    return
+                if snapshot is None:
+                    return
+                self.update(snapshot)
+
+        thread = threading.Thread(target=drain, name="metrics-listener", daemon=True)
+        thread.start()
+        return thread
+
+    def as_dict(self):
+        """
+        Current metrics as a JSON serializable dict.
+        """
+        with self._lock:
+            workers = [dict(snapshot) for snapshot in self.workers.values()]
+        completed = sum(w["runs_completed"] for w in workers)
+        running = sum(w["running"] for w in workers)
+        steps = sum(w["steps"] for w in workers)
+        step_seconds = sum(w["step_seconds"] for w in workers)
+        elapsed = time.time() - self.started
+        queued = max(self.runs_planned - completed - running, 0)
+        remaining = max(self.runs_planned - completed, 0)
+        eta = elapsed / completed * remaining if completed else None
+        for worker in workers:
+            worker["step_seconds_mean"] = (
+                worker["step_seconds"] / worker["steps"] if worker["steps"] else None
+            )
+        return {
+            "runs_planned": self.runs_planned,
+            "runs_completed": completed,
+            "runs_running": running,
+            "runs_queued": queued,
+            "steps": steps,
+            "step_seconds_mean": step_seconds / steps if steps else None,
+            "collection_rows": sum(w["collection_rows"] for w in workers),
+            "elapsed_seconds": elapsed,
+            "eta_seconds": eta,
+            "workers": workers,
+        }
+
+    def prometheus(self):
+        """
+        Current metrics in the Prometheus text exposition format.
+        """
+        metrics = self.as_dict()
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append(f"# HELP {PREFIX}_{name} {help}")
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                if value is None:
+                    continue
+                label = (
+                    "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+                    if labels
+                    else ""
+                )
+                lines.append(f"{PREFIX}_{name}{label} {value}")
+
+        metric(
+            "runs_planned",
+            "gauge",
+            "Runs in the sweep.",
+            [({}, metrics["runs_planned"])],
+        )
+        metric(
+            "runs_completed_total",
+            "counter",
+            "Runs finished.",
+            [({}, metrics["runs_completed"])],
+        )
+        metric(
+            "runs_running",
+            "gauge",
+            "Runs in progress.",
+            [({}, metrics["runs_running"])],
+        )
+        metric(
+            "runs_queued", "gauge", "Runs not started.", [({}, metrics["runs_queued"])]
+        )
+        metric(
+            "step_seconds_mean",
+            "gauge",
+            "Mean time of ProtestCascade.step over all workers.",
+            [({}, metrics["step_seconds_mean"])],
+        )
+        metric(
+            "eta_seconds",
+            "gauge",
+            "Estimated time until all runs are completed.",
+            [({}, metrics["eta_seconds"])],
+        )
+        workers = metrics["workers"]
+        per_worker = [
+            ("worker_steps_total", "counter", "Steps run.", "steps"),
+            (
+                "worker_steps_per_second",
+                "gauge",
+                "Steps per second since the previous report.",
+                "steps_per_second",
+            ),
+            (
+                "worker_step_seconds_mean",
+                "gauge",
+                "Mean time of ProtestCascade.step.",
+                "step_seconds_mean",
+            ),
+            (
+                "worker_peak_rss_bytes",
+                "gauge",
+                "Peak resident set size.",
+                "peak_rss_bytes",
+            ),
+            (
+                "worker_collection_rows",
+                "gauge",
+                "Rows held by the current run's data collector.",
+                "collection_rows",
+            ),
+            (
+                "worker_last_update_seconds",
+                "gauge",
+                "Unix time of the worker's last report.",
+                "updated",
+            ),
+        ]
+        for name, kind, help, key in per_worker:
+            metric(
+                name, kind, help, [({"worker": w["worker"]}, w[key]) for w in workers]
+            )
+        return "\n".join(lines) + "\n"
+
+
+def _metrics_handler():
+    """
+    Request handler class of the metrics server; http.server is only
+    imported when metrics are served.
+    """
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            registry = self.server.registry
+            if self.path == "/metrics":
+                body = registry.prometheus().encode()
+                content_type = "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body = json.dumps(registry.as_dict(), indent=2).encode()
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            log.debug("metrics request " + format, *args)
+
+    return MetricsHandler
+
+
+def serve_metrics(registry, port=9100, host="127.0.0.1"):
+    """
+    Serve registry on host:port from a daemon thread; returns the server,
+    call shutdown() on it to stop.
+    """
+    from http.server import ThreadingHTTPServer
+
+    server = ThreadingHTTPServer((host, port), _metrics_handler())
+    server.daemon_threads = True
+    server.registry = registry
+    thread = threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    )
+    thread.start()
+    log.info("Serving sweep metrics on http://%s:%s/metrics", host, server.server_port)
+    return server
@@ -1,9 +1,70 @@
 import mesa
 import math
+import time
+import uuid
 import logging as log
 import numpy as np
-from protest_cascade.scheduler import SimultaneousActivationByTypeFiltered
+from protest_cascade.scheduler import (
+    SimultaneousActivationByTypeFiltered,
+    TypePartitionedActivation,
+)
 from .agent import Citizen, Security
+from . import metrics
+from .logs import set_run_id
+from .memprofile import MemoryProfiler, agent_bytes
+from .collection import AgentTally, CollectionPolicy, EveryStep, SampledDataCollector
+from .influence import KERNELS, InfluenceField
+from .jail import Jail
+from .eventlog import EventLogWriter
+from .population import TEMPLATES
+from .rng import RandomStreams
+from .space import StencilGrid
+from .trajectory import TrajectoryWriter
+
+# agent reporters by group, so each group can be given its own collection
+# policy; an attribute missing on an agent type is reported as None
+AGENT_REPORTER_GROUPS = {
+    "state": {
+        "pos": "pos",
+        "condition": "condition",
+        "opinion": "opinion",
+        "activation": "activation",
+        "jail_sentence": "jail_sentence",
+        "flip": "flip",
+        "ever_flipped": "ever_flipped",
+    },
+    "traits": {
+        "private_preference": "private_preference",
+        "epsilon": "epsilon",
+        "threshold": "threshold",
+    },
+    "run": {
+        "model_seed": "dc_seed",
+        "model_security_density": "dc_security_density",
+        "model_private_preference": "dc_private_preference",
+        "model_epsilon": "dc_epsilon",
+        "model_threshold": "dc_threshold",
+    },
+}
+
+# column order of the single "agents" group collected by default
+AGENT_REPORTER_ORDER = [
+    "pos",
+    "condition",
+    "opinion",
+    "activation",
+    "private_preference",
+    "epsilon",
+    "threshold",
+    "jail_sentence",
+    "flip",
+    "ever_flipped",
+    "model_seed",
+    "model_security_density",
+    "model_private_preference",
+    "model_epsilon",
+    "model_threshold",
+]
 
 
 class ProtestCascade(mesa.Model):
@@ -20,7 +81,8 @@ class ProtestCascade(mesa.Model):
     movement: whether or not agents can move [boolean]
     multiple_agents_per_cell: whether or not multiple agents can occupy the same cell [boolean]
     network: whether or not agents are connected in a network with fixed settings [boolean]
-    network_discount: discount factor for network connections [float between 0 and 1]
+    network_discount: weight of protesting network contacts relative to protesting
+        neighbors in vision [float between 0 and 1]
     international_context: unused parameter currently
     private_preference_distribution_mean: the mean or center point of a normal distribution for private preference
     standard_deviation: the standard deviation of a normal distribution for private preference
@@ -29,6 +91,47 @@ class ProtestCascade(mesa.Model):
     max_iters: maximum number of iterations to run the model
     seed: seed for random number generator
     random_seed: whether or not to use a random seed for the random number generator
+    run_id: identifier stamped on every log record of this run, generated if None
+    agent_collection: agent-level collection policy; None records every agent every
+        step, a CollectionPolicy applies to all agent reporters, and a dict maps
+        AGENT_REPORTER_GROUPS names ("state", "traits", "run") to policies, leaving
+        groups not named uncollected
+    event_log: path of a binary event log of state transitions to write, see eventlog.py
+    event_keyframe_interval: steps between full-state keyframes in the event log
+    rng: "legacy" draws everything from the single model stream; "streams" gives
+        each purpose and agent its own stream derived from the seed (see rng.py),
+        so results do not depend on activation order
+    stencil_cache_bytes: memory budget of the grid's precomputed neighborhood tables
+    trajectory: directory of a memory-mapped trajectory store to write, see trajectory.py
+    trajectory_steps: steps to allocate in the trajectory store, max_iters + 2 if None
+        (step 0 and the steps of a run to completion, 1 to max_iters + 1)
+    population_template: draw citizens from the process-wide cache of base
+        populations (see population.py) rather than from scratch; same results
+    memory_profile: None, or a collection policy choosing the steps at which to
+        take tracemalloc snapshots attributed to agents, neighbor lists, grid,
+        scheduler and collector, see memprofile.py; also adds the "Peak RSS"
+        and "Bytes per Agent" model reporters
+    jail: "schedule" keeps jailed citizens in the schedule counting down their
+        sentence; "wheel" moves them to a timer wheel keyed by release step,
+        so step time does not grow with the prison population, with the same
+        results (see jail.py)
+    scheduler: "dict" activates agents from the schedule's agent dict;
+        "partitioned" from contiguous, index-stable per-type partitions (see
+        scheduler.py). Both defer converted defections and the jail wheel's
+        bookkeeping to one commit phase at the end of the tick
+    defection: "freeze" (the original behavior) leaves a defected security
+        agent in place, no longer arresting or moving; "convert" swaps it for
+        its protesting Citizen identity in the commit phase. "Defection Count"
+        counts the security agents that defected so far either way. With
+        "convert" the dict and partitioned schedulers diverge once a
+        defection happens: the new citizen is activated after the security
+        agents in the dict order but with the citizens in the partitions
+    influence: "window" has citizens count protesters and security agents in
+        their vision window; a kernel name ("square", "disk", "gaussian",
+        "exponential") computes that pressure for all cells at once as an FFT
+        convolution over the torus, see influence.py
+    influence_scale: length scale of the gaussian and exponential kernels,
+        citizen_vision if None
     """
 
     def __init__(
@@ -51,14 +154,56 @@ class ProtestCascade(mesa.Model):
         max_iters=1000,
         seed=None,
         random_seed=False,
+        run_id=None,
+        agent_collection=None,
+        event_log=None,
+        event_keyframe_interval=50,
+        rng="legacy",
+        stencil_cache_bytes=64 * 2**20,
+        trajectory=None,
+        trajectory_steps=None,
+        population_template=True,
+        memory_profile=None,
+        jail="schedule",
+        scheduler="dict",
+        defection="freeze",
+        influence="window",
+        influence_scale=None,
     ):
         super().__init__()
         if random_seed:
             self.reset_randomizer(np.random.randint(0, 1000000))
         else:
             self.reset_randomizer(seed)
-        print(f"Running ProtestCascade with seed {self._seed}")
-        log.info(f"Running ProtestCascade with seed {self._seed}")
+        if rng not in ("legacy", "streams"):
+            raise ValueError(f"rng must be 'legacy' or 'streams', not {rng!r}")
+        self.rng = rng
+        if jail not in ("schedule", "wheel"):
+            raise ValueError(f"jail must be 'schedule' or 'wheel', not {jail!r}")
+        if influence != "window" and influence not in KERNELS:
+            raise ValueError(
+                f"influence must be 'window' or one of {KERNELS}, not {influence!r}"
+            )
+        if scheduler not in ("dict", "partitioned"):
+            raise ValueError(
+                f"scheduler must be 'dict' or 'partitioned', not {scheduler!r}"
+            )
+        if defection not in ("freeze", "convert"):
+            raise ValueError(
+                f"defection must be 'freeze' or 'convert', not {defection!r}"
+            )
+        self.defection = defection
+        self.streams = RandomStreams(self._seed) if rng == "streams" else None
+        self.run_id = run_id if run_id is not None else uuid.uuid4().hex[:12]
+        set_run_id(self.run_id)
+        log.info("Running ProtestCascade with seed %s", self._seed)
+
+        # opt-in memory profiling, traced before anything is built
+        self.memory_profile = None
+        if memory_profile is not None:
+            self.memory_profile = MemoryProfiler(memory_profile)
+            self.memory_profile.start()
+
         self.width = width
         self.height = height
 
@@ -87,11 +232,19 @@ class ProtestCascade(mesa.Model):
         self.threshold = 3.595
         self.security_density = security_density
         self.security_vision = security_vision
+        self.influence = None
+        if influence != "window":
+            self.influence = InfluenceField(
+                width, height, influence, citizen_vision, influence_scale
+            )
+        self.protest_pressure = None
+        self.security_pressure = None
 
         # model level constants
 
         # model level constants
         self.max_jail_term = max_jail_term
+        self.jail = Jail(self, max_jail_term) if jail == "wheel" else None
         self.citizen_count = round(self.width * self.height * self.citizen_density)
         self.security_count = round(self.width * self.height * self.security_density)
         self.network_size = round(
@@ -105,29 +258,38 @@ class ProtestCascade(mesa.Model):
         self.max_iters = max_iters
         self.iteration = 0
         self.random_seed = random_seed
-        self.schedule = SimultaneousActivationByTypeFiltered(self)
-        self.grid = mesa.space.MultiGrid(self.width, self.height, torus=True)
+        self.population_template = population_template
+        if scheduler == "partitioned":
+            self.schedule = TypePartitionedActivation(self)
+        else:
+            self.schedule = SimultaneousActivationByTypeFiltered(self)
+        if self.jail is not None:
+            self.schedule.commit_hooks.append(self.jail.commit)
+        self.grid = StencilGrid(
+            self.width, self.height, torus=True, max_bytes=stencil_cache_bytes
+        )
+
+        # optional event sourcing output, agents record transitions into it
+        self.events = None
+        if event_log is not None:
+            self.events = EventLogWriter(
+                event_log, self.width, self.height, event_keyframe_interval
+            )
 
-        # agent counts
+        # agent counts, the reporters share one fused pass per step
         self.support_count = 0
         self.protest_count = 0
+        self.jail_count = 0
+        self.defection_count = 0
+        self.tally = AgentTally(
+            lambda kind: self.schedule.agents_by_type[kind].values()
+        )
+        self.tally.register(Citizen, "condition")
+        self.tally.register(Citizen, "flip")
 
         # Create agents
         # create Citizens
-        for i in range(self.citizen_count):
-            pos = None
-            if not self.multiple_agents_per_cell and len(self.grid.empties) > 0:
-                pos = self.random.choice(list(self.grid.empties))
-            else:
-                x = self.random.randrange(self.width)
-                y = self.random.randrange(self.height)
-                pos = (x, y)
-            # normal distribution of private regime preference
-            private_preference = self.random.gauss(
-                self.private_preference_distribution_mean, self.standard_deviation
-            )
-            # uniform distribution of error term on expectation of repression
-            epsilon = self.random.gauss(0, self.epsilon)
+        for pos, private_preference, epsilon in self.citizen_draws():
             # uniform distribution of threshold for protest
             threshold = self.sigmoid(self.threshold + epsilon)
             citizen = Citizen(
@@ -143,20 +305,7 @@ class ProtestCascade(mesa.Model):
             self.schedule.add(citizen)
 
         # create Security
-        for i in range(self.security_count):
-            pos = None
-            if not self.multiple_agents_per_cell and len(self.grid.empties) > 0:
-                pos = self.random.choice(list(self.grid.empties))
-            else:
-                x = self.random.randrange(self.width)
-                y = self.random.randrange(self.height)
-                pos = (x, y)
-
-            # normal distribution of private regime preference
-            private_preference = self.random.gauss(
-                self.private_preference_distribution_mean, self.standard_deviation
-            )
-
+        for pos, private_preference in self.security_draws():
             security = Security(
                 self.next_id(),
                 self,
@@ -174,31 +323,20 @@ class ProtestCascade(mesa.Model):
             "Protest Count": self.count_protest,
             "Support Count": self.count_support,
             "Jail Count": self.count_jail,
+            "Defection Count": self.count_defected,
             "Speed of Spread": self.speed_of_spread,
             "Security Density": self.report_security_density,
             "Private Preference": self.report_private_preference,
             "Episilon": self.report_epsilon,
             "Threshold": self.report_threshold,
         }
-        agent_reporters = {
-            "pos": lambda a: getattr(a, "pos", None),
-            "condition": lambda a: getattr(a, "condition", None),
-            "opinion": lambda a: getattr(a, "opinion", None),
-            "activation": lambda a: getattr(a, "activation", None),
-            "private_preference": lambda a: getattr(a, "private_preference", None),
-            "epsilon": lambda a: getattr(a, "epsilon", None),
-            "threshold": lambda a: getattr(a, "threshold", None),
-            "jail_sentence": lambda a: getattr(a, "jail_sentence", None),
-            "flip": lambda a: getattr(a, "flip", None),
-            "ever_flipped": lambda a: getattr(a, "ever_flipped", None),
-            "model_seed": lambda a: getattr(a, "dc_seed", None),
-            "model_security_density": lambda a: getattr(a, "dc_security_density", None),
-            "model_private_preference": lambda a: getattr(a, "dc_private_preference", None),
-            "model_epsilon": lambda a: getattr(a, "dc_epsilon", None),
-            "model_threshold": lambda a: getattr(a, "dc_threshold", None),
-            }
-        self.datacollector = mesa.DataCollector(
-            model_reporters=model_reporters, agent_reporters=agent_reporters
+        if self.memory_profile is not None:
+            # memory reporters cost time every step, profiled runs only
+            model_reporters["Peak RSS"] = self.report_peak_rss
+            model_reporters["Bytes per Agent"] = self.report_bytes_per_agent
+        self.datacollector = SampledDataCollector(
+            model_reporters=model_reporters,
+            agent_groups=self.agent_collection_groups(agent_collection),
         )
 
         # intializing the agent network
@@ -206,69 +344,356 @@ class ProtestCascade(mesa.Model):
             self.network_initialization()
 
         # set citizen states prior to first step
+        if self.influence is not None:
+            self.update_influence_fields()
         for agent in self.schedule.agents_by_type[Citizen].values():
-            agent.neighborhood = agent.update_neighbors()
+            if self.influence is None:
+                agent.neighborhood = agent.update_neighbors()
+            else:
+                agent.neighborhood = None
             agent.determine_condition()
+        self.grid.log_stencil_memory()
+
+        # optional memory-mapped trajectory output, one row per step
+        self.trajectory = None
+        if trajectory is not None:
+            self.trajectory = TrajectoryWriter(
+                trajectory,
+                trajectory_steps if trajectory_steps is not None else max_iters + 2,
+                self.schedule.agents,
+                self.run_parameters(),
+            )
 
         # The final step is to set the model running
         self.running = True
+        self.tally.invalidate()
         self.datacollector.collect(self)
+        if self.events is not None:
+            self.events.end_step(self.schedule.agents)
+        if self.trajectory is not None:
+            self.trajectory.write(self.schedule.steps, self.schedule.agents)
+        if self.memory_profile is not None:
+            self.memory_profile.maybe_snapshot(self)
 
     def step(self):
         """
         Advance the model by one step and collect data.
         """
-        self.schedule.step()
+        start = time.perf_counter()
+        if self.events is not None:
+            self.events.begin_step(self.schedule.steps + 1)
 
-        # defecting security outside of step function to avoid errors
-        for agent in self.schedule.agents_by_type[Security].values():
-            if agent.condition == "defect":
-                agent.remove_thyself()
-                del agent
+        if self.network:
+            self.update_network_exposure()
+        if self.influence is not None:
+            self.update_influence_fields()
+
+        # conversions and the jail wheel are committed at the end of the tick
+        self.schedule.step()
 
         # collect data
+        self.tally.invalidate()
         self.datacollector.collect(self)
-
-        # update agent counts
+        if self.events is not None:
+            self.events.end_step(self.schedule.agents)
+        if self.trajectory is not None:
+            self.trajectory.write(self.schedule.steps, self.schedule.agents)
+        if self.memory_profile is not None:
+            self.memory_profile.maybe_snapshot(self)
+
+        # update agent counts, from the tally the collector just made
         self.protest_count = self.count_protest(self)
         self.support_count = self.count_support(self)
+        self.jail_count = self.count_jail(self)
 
         # update iteration
         self.iteration += 1
         if self.iteration > self.max_iters:
             self.running = False
 
+        if metrics.RECORDER is not None:
+            metrics.RECORDER.step(self, time.perf_counter() - start)
+
+    def close(self):
+        """
+        Flush and close the run's file outputs (event log, trajectory), stop
+        memory tracing and count the run as completed in the live metrics.
+        """
+        if self.events is not None:
+            self.events.close()
+        if self.trajectory is not None:
+            self.trajectory.close()
+        if self.memory_profile is not None:
+            self.memory_profile.stop()
+        if metrics.RECORDER is not None:
+            metrics.RECORDER.run_finished(self)
+
+    def run_parameters(self):
+        """
+        The run's parameters as a JSON serializable dict.
+        """
+        return {
+            "seed": self._seed,
+            "rng": self.rng,
+            "width": self.width,
+            "height": self.height,
+            "citizen_vision": self.citizen_vision,
+            "citizen_density": self.citizen_density,
+            "citizen_count": self.citizen_count,
+            "security_density": self.security_density,
+            "security_vision": self.security_vision,
+            "security_count": self.security_count,
+            "max_jail_term": self.max_jail_term,
+            "jail": "wheel" if self.jail is not None else "schedule",
+            "scheduler": (
+                "partitioned"
+                if isinstance(self.schedule, TypePartitionedActivation)
+                else "dict"
+            ),
+            "defection": self.defection,
+            "movement": self.movement,
+            "multiple_agents_per_cell": self.multiple_agents_per_cell,
+            "network": self.network,
+            "network_discount": self.network_discount,
+            "private_preference_distribution_mean": self.private_preference_distribution_mean,
+            "standard_deviation": self.standard_deviation,
+            "epsilon": self.epsilon,
+            "threshold": self.threshold,
+            "influence": self.influence.shape
+            if self.influence is not None
+            else "window",
+            "influence_scale": self.influence.scale
+            if self.influence is not None
+            else None,
+            "run_id": self.run_id,
+        }
+
+    def update_influence_fields(self):
+        """
+        Convolve the cells' protesters and security agents with the influence
+        kernel; citizens read their pressure from the two fields, which hold
+        the state at the start of the step like the vision windows would.
+        """
+        protesters = [
+            agent.pos
+            for agent in self.schedule.agents_by_type[Citizen].values()
+            if agent.condition == "Protest"
+        ]
+        security = [
+            agent.pos for agent in self.schedule.agents_by_type[Security].values()
+        ]
+        field = self.influence
+        # nested lists, indexed [x][y] faster than arrays from agent code
+        self.protest_pressure = field.convolve(field.occupancy(protesters)).tolist()
+        self.security_pressure = field.convolve(field.occupancy(security)).tolist()
+
+    @staticmethod
+    def agent_collection_groups(agent_collection):
+        """
+        Translate the agent_collection parameter into the agent groups of
+        the SampledDataCollector.
+        """
+        all_reporters = {}
+        for reporters in AGENT_REPORTER_GROUPS.values():
+            all_reporters.update(reporters)
+        if agent_collection is None:
+            agent_collection = EveryStep()
+        if isinstance(agent_collection, CollectionPolicy):
+            reporters = {name: all_reporters[name] for name in AGENT_REPORTER_ORDER}
+            return {"agents": (reporters, agent_collection)}
+        return {
+            name: (AGENT_REPORTER_GROUPS[name], policy)
+            for name, policy in agent_collection.items()
+        }
+
+    def citizen_draws(self):
+        """
+        Yield (pos, private_preference, epsilon) for each citizen to create.
+
+        With rng="legacy" the draws are interleaved on the model stream exactly
+        as they always were, so placement must be consumed as it is yielded.
+        With rng="streams" every quantity is one batched draw from its own
+        stream: positions from a permutation of the cells (or uniform cells if
+        several agents may share one), and standard normals for preference and
+        epsilon noise that are only then scaled by the parameters.
+
+        With population_template (and a fixed seed) the same draws come from
+        the cached PopulationTemplate of the seed, and in legacy mode the model
+        stream is then set to where the draws left it.
+        """
+        if self.population_template and self._seed is not None:
+            template = TEMPLATES.get(
+                self._seed,
+                self.width,
+                self.height,
+                self.citizen_count,
+                self.multiple_agents_per_cell,
+                self.rng,
+            )
+            yield from template.citizen_draws(
+                self.private_preference_distribution_mean,
+                self.standard_deviation,
+                self.epsilon,
+            )
+            if template.random_state is not None:
+                self.random.setstate(template.random_state)
+            return
+
+        if self.streams is None:
+            for i in range(self.citizen_count):
+                pos = self.random_position()
+                # normal distribution of private regime preference
+                private_preference = self.random.gauss(
+                    self.private_preference_distribution_mean, self.standard_deviation
+                )
+                # uniform distribution of error term on expectation of repression
+                epsilon = self.random.gauss(0, self.epsilon)
+                yield pos, private_preference, epsilon
+            return
+
+        positions = self.stream_positions(0, self.citizen_count)
+        preference = self.streams.generator("preference", 0).standard_normal(
+            self.citizen_count
+        )
+        noise = self.streams.generator("epsilon", 0).standard_normal(self.citizen_count)
+        for pos, z, e in zip(positions, preference.tolist(), noise.tolist()):
+            private_preference = (
+                self.private_preference_distribution_mean + z * self.standard_deviation
+            )
+            yield pos, private_preference, e * self.epsilon
+
+    def security_draws(self):
+        """
+        Yield (pos, private_preference) for each security agent to create,
+        see citizen_draws.
+        """
+        if self.streams is None:
+            for i in range(self.security_count):
+                pos = self.random_position()
+                # normal distribution of private regime preference
+                private_preference = self.random.gauss(
+                    self.private_preference_distribution_mean, self.standard_deviation
+                )
+                yield pos, private_preference
+            return
+
+        positions = self.stream_positions(self.citizen_count, self.security_count)
+        preference = self.streams.generator("preference", 1).standard_normal(
+            self.security_count
+        )
+        for pos, z in zip(positions, preference.tolist()):
+            private_preference = (
+                self.private_preference_distribution_mean + z * self.standard_deviation
+            )
+            yield pos, private_preference
+
+    def random_position(self):
+        """
+        Draw a cell from the model stream, an empty one if agents may not
+        share cells and any are left.
+        """
+        if not self.multiple_agents_per_cell and len(self.grid.empties) > 0:
+            # the same draw as choice(list(self.grid.empties)), without listing
+            return self.random.choice(self.grid.empty_cells())
+        x = self.random.randrange(self.width)
+        y = self.random.randrange(self.height)
+        return (x, y)
+
+    def stream_positions(self, start, count):
+        """
+        Positions start to start + count of the placement stream.
+
+        Without multiple agents per cell, citizens and then security take
+        consecutive cells of one permutation of the grid (uniform cells once it
+        runs out); otherwise each population draws uniform cells from its own
+        stream. Either way the citizens' cells do not depend on security_density.
+        """
+        cells = self.width * self.height
+        if self.multiple_agents_per_cell:
+            population = 0 if start == 0 else 1
+            flat = self.streams.generator("placement", population).integers(
+                cells, size=count
+            )
+        else:
+            placement = self.streams.generator("placement", 0)
+            flat = placement.permutation(cells)
+            if start + count > cells:
+                extra = placement.integers(cells, size=start + count - cells)
+                flat = np.concatenate([flat, extra])
+            flat = flat[start : start + count]
+        return [(c // self.height, c % self.height) for c in flat.tolist()]
+
     def network_initialization(self):
         """
         Initialize the network of agents for each agent in the model.
 
         preferences agents that are closer to them and normalizes the distances
-        """
-        for agent in self.schedule.agents_by_type[Citizen].values():
 
-            # create a list of tuples of (agent, distance to agent) distances
-            # from this agent to all other agents
-            distances = []
-            for other_agent in self.schedule.agents_by_type[Citizen].values():
-                if agent is not other_agent:
-                    distances.append(
-                        (other_agent, self.distance_calculation(agent, other_agent))
-                    )
-            # assign max distance
-            max_distance = max(distances, key=lambda x: x[1])[1]
-            # normalise all distances to be between 0 and 1 and replace
-            # the distance with the normalised distance
-            distances = [
-                (agent, distance / max_distance) for agent, distance in distances
-            ]
-            # assign network as a list to agent.network as a random
-            # distribution of up to citizen_network_size agents preferring but not
-            # limited to agents that are closer
-            agent.network = self.random.choices(
-                [agent for agent, distance in distances],
-                weights=[distance for agent, distance in distances],
-                k=self.network_size,
+        Each citizen draws network_size contacts (with replacement) from all
+        other citizens, weighted by their normalized distance, with the same
+        bisection random.choices uses, so legacy runs keep their networks.
+        The contacts are stored both as agent.network and as the CSR
+        adjacency matrix network_adjacency over citizen indices, whose entry
+        (i, j) counts how often citizen j appears in citizen i's network.
+        """
+        # scipy loads with the first network, headless runs without one skip it
+        from scipy import sparse
+
+        citizens = list(self.schedule.agents_by_type[Citizen].values())
+        count = len(citizens)
+        self.network_citizens = citizens
+        for index, agent in enumerate(citizens):
+            agent.network_index = index
+        if count < 2:
+            for agent in citizens:
+                agent.network = []
+            self.network_adjacency = sparse.csr_matrix((count, count))
+            self.update_network_exposure()
+            return
+
+        xy = np.array([agent.pos for agent in citizens], dtype=np.float64)
+        k = self.network_size
+        if self.streams is not None:
+            uniforms = self.streams.generator("network").random((count, k))
+
+        columns = np.empty((count, k), dtype=np.int64)
+        for i in range(count):
+            # distances from this agent to all other agents, in agent order
+            distances = np.sqrt(((xy - xy[i]) ** 2).sum(axis=1))
+            distances = np.delete(distances, i)
+            # normalise all distances to be between 0 and 1
+            weights = distances / distances.max()
+            cumulative = np.cumsum(weights)
+            if self.streams is None:
+                draws = np.array([self.random.random() for _ in range(k)])
+            else:
+                draws = uniforms[i]
+            chosen = np.searchsorted(
+                cumulative, draws * (cumulative[-1] + 0.0), side="right"
             )
+            chosen = np.minimum(chosen, count - 2)
+            # skip over the agent itself
+            columns[i] = chosen + (chosen >= i)
+
+        rows = np.repeat(np.arange(count), k)
+        self.network_adjacency = sparse.csr_matrix(
+            (np.ones(count * k), (rows, columns.ravel())), shape=(count, count)
+        )
+        for agent, contacts in zip(citizens, columns.tolist()):
+            agent.network = [citizens[j] for j in contacts]
+        self.update_network_exposure()
+
+    def update_network_exposure(self):
+        """
+        Count each citizen's protesting network contacts with one sparse
+        matrix-vector product of the protest indicator vector.
+        """
+        protesting = np.fromiter(
+            (agent.condition == "Protest" for agent in self.network_citizens),
+            dtype=np.float64,
+            count=len(self.network_citizens),
+        )
+        self.network_exposure = (self.network_adjacency @ protesting).tolist()
 
     ############################################################################
     ############################################################################
@@ -315,56 +740,36 @@ class ProtestCascade(mesa.Model):
         """
         Calculates the speed of transmission of the rebellion.
         """
-        return (
-            len(
-                [
-                    agent
-                    for agent in model.schedule.agents_by_type[Citizen].values()
-                    if agent.flip is True
-                ]
-            )
-            / model.citizen_count
-        )
+        return model.tally.count(Citizen, "flip", True) / model.citizen_count
 
     @staticmethod
     def count_protest(model):
         """
         Helper method to count protesting agents.
         """
-        return len(
-            [
-                agent
-                for agent in model.schedule.agents_by_type[Citizen].values()
-                if agent.condition == "Protest"
-            ]
-        )
+        return model.tally.count(Citizen, "condition", "Protest")
 
     @staticmethod
     def count_support(model):
         """
         Helper method to count publicly supporting agents.
         """
-        return len(
-            [
-                agent
-                for agent in model.schedule.agents_by_type[Citizen].values()
-                if agent.condition == "Support"
-            ]
-        )
+        return model.tally.count(Citizen, "condition", "Support")
 
     @staticmethod
     def count_jail(model):
         """
         Helper method to count jailed agents.
         """
-        return len(
-            [
-                agent
-                for agent in model.schedule.agents_by_type[Citizen].values()
-                if agent.condition == "Jailed"
-            ]
-        )
-    
+        return model.tally.count(Citizen, "condition", "Jailed")
+
+    @staticmethod
+    def count_defected(model):
+        """
+        Helper method to count security agents that have defected so far.
+        """
+        return model.defection_count
+
     @staticmethod
     def report_security_density(model):
         """
@@ -392,4 +797,19 @@ class ProtestCascade(mesa.Model):
         Helper method to count threshold.
         """
         return model.threshold
+
+    @staticmethod
+    def report_peak_rss(model):
+        """
+        Helper method to report the peak resident set size of the process.
+        """
+        return metrics.peak_rss_bytes()
+
+    @staticmethod
+    def report_bytes_per_agent(model):
+        """
+        Helper method to report the shallow bytes held per agent, including
+        its neighbor and network lists.
+        """
+        return agent_bytes(model.schedule.agents)
     
\ No newline at end of file
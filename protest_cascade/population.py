@@ -0,0 +1,190 @@
+"""
+Base population templates shared across sweep points.
+
+Citizen positions and the standard normal draws behind private preference and
+epsilon noise depend only on the seed, the grid and the citizen count, not on
+the preference mean, standard deviation, epsilon or security density that a
+sweep varies. A PopulationTemplate holds those draws as read-only NumPy arrays,
+built once per (seed, width, height, citizen_count, multiple_agents_per_cell,
+rng); each model then only scales the normals by its own parameters and
+places its security agents on top.
+
+Results are identical to building the population from scratch. With
+rng="legacy" the template replays the model stream's draws on a scratch copy
+of the grid's empty cells, records gauss(0, 1) in place of gauss(mean, sd)
+(which is mean + z * sd from the same state) and saves the stream state after
+the last citizen, so the model carries on from exactly where it would have.
+
+Templates live in a per-process LRU cache. Sweeps warm the cache before
+forking their workers so the arrays are shared copy-on-write.
+
+Example:
+>>> template = TEMPLATES.get(287, 40, 40, 1120, False, "legacy")
+>>> template.citizen_positions.shape
+(1120, 2)
+"""
+import itertools
+import logging as log
+import random
+from collections import OrderedDict
+
+import numpy as np
+
+from .rng import RandomStreams
+from .space import EmptyCellOrder
+
+
+class PopulationTemplate:
+    """
+    Read-only base draws of one citizen population.
+
+    citizen_positions: (citizen_count, 2) int32 cells
+    preference_z: standard normals scaled into private preference
+    epsilon_z: standard normals scaled into epsilon noise
+    random_state: legacy model stream state after the citizen draws, or None
+    """
+
+    def __init__(self, key, citizen_positions, preference_z, epsilon_z, random_state):
+        self.key = key
+        self.citizen_positions = citizen_positions
+        self.preference_z = preference_z
+        self.epsilon_z = epsilon_z
+        self.random_state = random_state
+        for array in (citizen_positions, preference_z, epsilon_z):
+            array.flags.writeable = False
+
+    @property
+    def nbytes(self):
+        return (
+            self.citizen_positions.nbytes
+            + self.preference_z.nbytes
+            + self.epsilon_z.nbytes
+        )
+
+    def citizen_draws(self, mean, standard_deviation, epsilon):
+        """
+        Yield (pos, private_preference, epsilon) for each citizen, the
+        template's normals scaled by the point's parameters.
+        """
+        # gauss(0, epsilon) returns 0 + z * epsilon, which only differs from
+        # the streams' z * epsilon in the sign of a zero
+        offset = 0 if self.random_state is not None else -0.0
+        positions = map(tuple, self.citizen_positions.tolist())
+        for pos, z, e in zip(
+            positions, self.preference_z.tolist(), self.epsilon_z.tolist()
+        ):
+            yield pos, mean + z * standard_deviation, offset + e * epsilon
+
+
+def build_template(seed, width, height, citizen_count, multiple_agents_per_cell, rng):
+    """
+    Draw the base citizen population of a seed.
+    """
+    key = (seed, width, height, citizen_count, multiple_agents_per_cell, rng)
+    if rng == "legacy":
+        return _legacy_template(key)
+
+    streams = RandomStreams(seed)
+    cells = width * height
+    if multiple_agents_per_cell:
+        flat = streams.generator("placement", 0).integers(cells, size=citizen_count)
+    else:
+        placement = streams.generator("placement", 0)
+        flat = placement.permutation(cells)
+        if citizen_count > cells:
+            extra = placement.integers(cells, size=citizen_count - cells)
+            flat = np.concatenate([flat, extra])
+        flat = flat[:citizen_count]
+    positions = np.stack(np.divmod(flat, height), axis=1).astype(np.int32)
+    preference = streams.generator("preference", 0).standard_normal(citizen_count)
+    noise = streams.generator("epsilon", 0).standard_normal(citizen_count)
+    return PopulationTemplate(key, positions, preference, noise, None)
+
+
+def _legacy_template(key):
+    """
+    Replay the legacy model stream's citizen draws, see
+    ProtestCascade.citizen_draws and random_position.
+    """
+    seed, width, height, citizen_count, multiple_agents_per_cell, _ = key
+    stream = random.Random(seed)
+    # same construction and discards as the grid's empties, so the set
+    # iterates in the same order
+    empties = EmptyCellOrder(set(itertools.product(range(width), range(height))))
+    positions = np.empty((citizen_count, 2), dtype=np.int32)
+    preference = np.empty(citizen_count)
+    noise = np.empty(citizen_count)
+    for i in range(citizen_count):
+        if not multiple_agents_per_cell and len(empties) > 0:
+            pos = stream.choice(empties)
+        else:
+            pos = (stream.randrange(width), stream.randrange(height))
+        empties.discard(pos)
+        positions[i] = pos
+        preference[i] = stream.gauss(0, 1)
+        noise[i] = stream.gauss(0, 1)
+    return PopulationTemplate(key, positions, preference, noise, stream.getstate())
+
+
+class TemplateCache:
+    """
+    Least recently used cache of population templates.
+
+    max_templates: templates kept per process
+    """
+
+    def __init__(self, max_templates=64):
+        self.max_templates = max_templates
+        self._templates = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, seed, width, height, citizen_count, multiple_agents_per_cell, rng):
+        """
+        The template of a population, built on first use.
+        """
+        key = (seed, width, height, citizen_count, multiple_agents_per_cell, rng)
+        template = self._templates.get(key)
+        if template is not None:
+            self._templates.move_to_end(key)
+            self.hits += 1
+            return template
+        self.misses += 1
+        template = build_template(*key)
+        self._templates[key] = template
+        while len(self._templates) > self.max_templates:
+            self._templates.popitem(last=False)
+        return template
+
+    def clear(self):
+        self._templates.clear()
+
+    def info(self):
+        """
+        Report of the cached templates and their memory use.
+        """
+        return {
+            "templates": len(self._templates),
+            "nbytes": sum(t.nbytes for t in self._templates.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def warm(self, keys):
+        """
+        Build the templates of keys ahead of time, e.g. before forking
+        workers so they share them copy-on-write.
+        """
+        keys = list(dict.fromkeys(keys))
+        if len(keys) > self.max_templates:
+            log.warning(
+                "Warming %s population templates, only %s are kept",
+                len(keys),
+                self.max_templates,
+            )
+        for key in keys:
+            self.get(*key)
+        log.info("Population template cache %s", self.info())
+
+
+TEMPLATES = TemplateCache()
@@ -0,0 +1,153 @@
+"""
+Counter-based random number streams derived from the run seed.
+
+With a single random.Random every draw depends on how many draws came before
+it, so changing the activation order, or running agents in parallel, changes
+every result. RandomStreams instead derives an independent Philox stream per
+purpose (and per agent, where the draws belong to an agent) from a NumPy
+SeedSequence spawn tree rooted at the run seed:
+
+    seed -> (purpose,) -> (purpose, unique_id)
+
+A draw therefore depends only on the seed, the purpose, the agent and how many
+draws that agent made for that purpose, never on the order agents run in.
+Population-level draws (positions, preferences, epsilon noise) are made as
+whole arrays, and per-agent streams hand out uniforms and raw bits in batches.
+
+Example:
+>>> streams = RandomStreams(42)
+>>> z = streams.generator("preference").standard_normal(1120)
+>>> streams.random("move", 17).choice([(0, 1), (1, 0)])
+"""
+import copy
+import random
+
+import numpy as np
+
+# every purpose gets its own branch of the spawn tree; append new purposes at
+# the end so existing streams keep their keys
+PURPOSES = (
+    "placement",
+    "preference",
+    "epsilon",
+    "move",
+    "arrest",
+    "release",
+    "defect",
+    "network",
+)
+PURPOSE_KEYS = {purpose: key for key, purpose in enumerate(PURPOSES)}
+
+
+class StreamRandom(random.Random):
+    """
+    random.Random interface over a NumPy Generator, so agent code can keep
+    calling choice, randint and gauss. Uniforms and raw 64 bit words are
+    drawn batch at a time from the generator.
+    """
+
+    VERSION = 1
+
+    def __init__(self, generator, batch=64):
+        self._generator = generator
+        self._batch = batch
+        self._uniforms = []
+        self._words = []
+        super().__init__()
+
+    def seed(self, *args, **kwargs):
+        """
+        Streams are seeded through their SeedSequence, not here.
+        """
+        self.gauss_next = None
+
+    def random(self):
+        if not self._uniforms:
+            self._uniforms = self._generator.random(self._batch).tolist()
+            self._uniforms.reverse()
+        return self._uniforms.pop()
+
+    def _word(self):
+        if not self._words:
+            self._words = self._generator.bit_generator.random_raw(self._batch).tolist()
+            self._words.reverse()
+        return self._words.pop()
+
+    def getrandbits(self, k):
+        if k <= 0:
+            return 0
+        if k <= 64:
+            return self._word() >> (64 - k)
+        value = 0
+        for _ in range((k + 63) // 64):
+            value = (value << 64) | self._word()
+        return value >> (-k % 64)
+
+    def getstate(self):
+        """
+        The generator's bit generator state plus the buffered draws, so a
+        restored stream continues exactly where this one was.
+        """
+        return (
+            self.VERSION,
+            copy.deepcopy(self._generator.bit_generator.state),
+            tuple(self._uniforms),
+            tuple(self._words),
+            self.gauss_next,
+        )
+
+    def setstate(self, state):
+        version, bit_generator_state, uniforms, words, gauss_next = state
+        if version != self.VERSION:
+            raise ValueError(
+                f"state with version {version} passed to StreamRandom "
+                f"version {self.VERSION}"
+            )
+        self._generator.bit_generator.state = copy.deepcopy(bit_generator_state)
+        self._uniforms = list(uniforms)
+        self._words = list(words)
+        self.gauss_next = gauss_next
+
+    def __reduce__(self):
+        return self.__class__, (self._generator, self._batch), self.getstate()
+
+
+class RandomStreams:
+    """
+    Spawn tree of per-purpose and per-agent streams for one run.
+
+    seed: run seed; None draws fresh entropy, available afterwards as .seed
+    """
+
+    def __init__(self, seed=None):
+        self._root = np.random.SeedSequence(seed)
+        self.seed = self._root.entropy
+        self._random = {}
+
+    def sequence(self, purpose, *key):
+        """
+        SeedSequence of a purpose, optionally narrowed by integer keys such
+        as an agent's unique_id.
+        """
+        return np.random.SeedSequence(
+            self.seed, spawn_key=(PURPOSE_KEYS[purpose],) + tuple(key)
+        )
+
+    def generator(self, purpose, *key):
+        """
+        A fresh Generator at the start of the stream; use it for batched
+        population draws that are made once.
+        """
+        return np.random.Generator(np.random.Philox(self.sequence(purpose, *key)))
+
+    def random(self, purpose, *key):
+        """
+        The cached StreamRandom of a purpose and key, continuing where the
+        last draw left off.
+        """
+        stream_key = (purpose,) + key
+        stream = self._random.get(stream_key)
+        if stream is None:
+            stream = StreamRandom(self.generator(purpose, *key))
+            self._random[stream_key] = stream
+        return stream
@@ -0,0 +1,248 @@
+"""
+Scaling checks for construction, step and collection time.
+
+Runs ProtestCascade at increasing grid sizes (agent counts at fixed density)
+and increasing vision, fits the empirical exponent b of time ~ size**b on a
+log-log scale and fails when a path grows faster than it should:
+
+    construction    agents          expected 1 (placement, initial conditions)
+    step            agents          expected 1
+    collection      agents          expected 1
+    vision          cells in vision expected 1 (step time)
+    influence       cells in vision expected 0 (step time, FFT influence field)
+    template        agents          expected 1 (legacy population template)
+    network         citizens        expected 2 (a distance row to every other
+                                    citizen for each citizen)
+
+A check fails when the fitted exponent exceeds the expected one by more than
+the tolerance. Constant-factor slowdowns pass; scaling cliffs that would only
+show at production grid sizes do not. Timings are the best of --repeats runs.
+Linear paths fit at about 1.1 to 1.35 between 20x20 and 80x80 grids because
+larger populations fall out of the CPU caches, hence the default tolerance of
+0.5; a quadratic path fits close to 2.
+
+Network contacts are weighted by the distance to every other citizen, so
+network construction is quadratic. Below a few thousand citizens the per
+citizen loop overhead hides the quadratic term (it fits about 1.1 between
+20x20 and 40x40 grids), so the network check runs on 40x40 to 120x120 grids
+(1120 to 10080 citizens), where it fits about 1.5 to 1.8 and a cubic
+regression would fail.
+
+Usage:
+    $ python -m protest_cascade.scaling
+    $ python -m protest_cascade.scaling --sizes 20 40 80 160 --tolerance 0.4
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from .model import ProtestCascade
+from .population import build_template
+
+EXPECTED = {
+    "construction": 1,
+    "step": 1,
+    "collection": 1,
+    "vision": 1,
+    "influence": 0,
+    "template": 1,
+    "network": 2,
+}
+
+BASE_PARAMETERS = dict(
+    citizen_density=0.7,
+    security_density=0.04,
+    private_preference_distribution_mean=0,
+    epsilon=0.5,
+    seed=1,
+)
+
+
+def best_time(function, repeats):
+    """
+    Shortest wall time of repeats calls of function.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def fit_exponent(sizes, times):
+    """
+    Slope of log(time) against log(size).
+    """
+    slope, _ = np.polyfit(np.log(sizes), np.log(times), 1)
+    return float(slope)
+
+
+def measure_agents(sizes, vision, steps, repeats):
+    """
+    Construction, mean step and collection time at each grid size.
+    """
+    rows = []
+    for size in sizes:
+        parameters = dict(
+            BASE_PARAMETERS,
+            width=size,
+            height=size,
+            citizen_vision=vision,
+            security_vision=vision,
+            population_template=False,
+        )
+        construction = best_time(lambda: ProtestCascade(**parameters), repeats)
+        model = ProtestCascade(**parameters)
+        agents = len(model.schedule.agents)
+        step = best_time(lambda: [model.step() for _ in range(steps)], repeats) / steps
+        collection = best_time(lambda: model.datacollector.collect(model), repeats)
+        template = best_time(
+            lambda: build_template(
+                parameters["seed"], size, size, model.citizen_count, False, "legacy"
+            ),
+            repeats,
+        )
+        rows.append(
+            dict(
+                size=size,
+                agents=agents,
+                construction=construction,
+                step=step,
+                collection=collection,
+                template=template,
+            )
+        )
+    return rows
+
+
+def measure_vision(size, visions, steps, repeats, influence="window"):
+    """
+    Mean step time at each vision radius.
+    """
+    rows = []
+    for vision in visions:
+        model = ProtestCascade(
+            **dict(
+                BASE_PARAMETERS,
+                width=size,
+                height=size,
+                citizen_vision=vision,
+                security_vision=vision,
+                influence=influence,
+            )
+        )
+        step = best_time(lambda: [model.step() for _ in range(steps)], repeats) / steps
+        rows.append(dict(vision=vision, cells=(2 * vision + 1) ** 2 - 1, step=step))
+    return rows
+
+
+def measure_network(sizes, repeats):
+    """
+    Network initialization time at each grid size.
+    """
+    rows = []
+    for size in sizes:
+        model = ProtestCascade(
+            **dict(BASE_PARAMETERS, width=size, height=size, network=True)
+        )
+        network = best_time(model.network_initialization, repeats)
+        rows.append(dict(size=size, citizens=model.citizen_count, network=network))
+    return rows
+
+
+def check(
+    sizes=(20, 40, 80),
+    vision=7,
+    vision_size=40,
+    visions=(1, 2, 4, 8),
+    network_sizes=(40, 80, 120),
+    steps=3,
+    repeats=3,
+    tolerance=0.5,
+):
+    """
+    Measure every path and return (results, measurements); each result is
+    a dict with the fitted exponent, its limit and whether it passed.
+    """
+    agents = measure_agents(sizes, vision, steps, repeats)
+    by_vision = measure_vision(vision_size, visions, steps, repeats)
+    by_influence = measure_vision(vision_size, visions, steps, repeats, "square")
+    network = measure_network(network_sizes, repeats)
+
+    series = {
+        name: ([row["agents"] for row in agents], [row[name] for row in agents])
+        for name in ("construction", "step", "collection", "template")
+    }
+    series["vision"] = (
+        [row["cells"] for row in by_vision],
+        [row["step"] for row in by_vision],
+    )
+    series["influence"] = (
+        [row["cells"] for row in by_influence],
+        [row["step"] for row in by_influence],
+    )
+    series["network"] = (
+        [row["citizens"] for row in network],
+        [row["network"] for row in network],
+    )
+
+    results = []
+    for name, (x, y) in series.items():
+        exponent = fit_exponent(x, y)
+        limit = EXPECTED[name] + tolerance
+        results.append(
+            dict(
+                check=name,
+                expected=EXPECTED[name],
+                exponent=round(exponent, 3),
+                limit=limit,
+                passed=exponent <= limit,
+            )
+        )
+    measurements = dict(
+        agents=agents, vision=by_vision, influence=by_influence, network=network
+    )
+    return results, measurements
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 40, 80])
+    parser.add_argument("--vision", type=int, default=7)
+    parser.add_argument("--vision-size", type=int, default=40)
+    parser.add_argument("--visions", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--network-sizes", type=int, nargs="+", default=[40, 80, 120])
+    parser.add_argument("--steps", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("-o", "--output", default=None, help="JSON report path")
+    args = parser.parse_args(argv)
+
+    results, measurements = check(
+        sizes=args.sizes,
+        vision=args.vision,
+        vision_size=args.vision_size,
+        visions=args.visions,
+        network_sizes=args.network_sizes,
+        steps=args.steps,
+        repeats=args.repeats,
+        tolerance=args.tolerance,
+    )
+    for result in results:
+        status = "ok" if result["passed"] else "FAIL"
+        print(
+            f"{status:4} {result['check']:12} exponent {result['exponent']:6.3f} "
+            f"(expected {result['expected']}, limit {result['limit']:.2f})"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(dict(results=results, measurements=measurements), f, indent=2)
+    return 0 if all(result["passed"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
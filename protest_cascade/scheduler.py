@@ -3,6 +3,8 @@ from typing import Type, Callable
 from mesa.agent import Agent
 from mesa.model import Model
 
+import bisect
+import itertools
 from collections import defaultdict
 
 
@@ -20,6 +22,51 @@ class SimultaneousActivationByTypeFiltered(mesa.time.SimultaneousActivation):
     def __init__(self, model: Model) -> None:
         super().__init__(model)
         self.agents_by_type = defaultdict(dict)
+        # agents kept in the model but left out of the activation order
+        self._inactive = {}
+        # every agent in the order added, and the active ones in that order
+        # with their sequence numbers, so a reactivated agent is put back at
+        # its old place by bisection
+        self._all = {}
+        self._order = {}
+        self._sequence = itertools.count()
+        self._activation = []
+        self._keys = []
+        # structural changes queued during the tick, applied by commit()
+        self._deferred = []
+        self.commit_hooks = []
+
+    def step(self) -> None:
+        """
+        Step all active agents, then advance them, then commit the changes
+        they queued.
+        """
+        activation = self._activation
+        for agent in activation:
+            agent.step()
+        for agent in activation:
+            agent.advance()
+        self.steps += 1
+        self.time += 1
+        self.commit()
+
+    def defer(self, change: Callable, *args) -> None:
+        """
+        Queue a structural change (adding, removing, (de)activating agents)
+        for the commit phase at the end of the tick.
+        """
+        self._deferred.append((change, args))
+
+    def commit(self) -> None:
+        """
+        Apply the queued changes in the order they were queued, then run the
+        commit hooks.
+        """
+        deferred, self._deferred = self._deferred, []
+        for change, args in deferred:
+            change(*args)
+        for hook in self.commit_hooks:
+            hook()
 
     def add(self, agent: Agent) -> None:
         """
@@ -32,17 +79,58 @@ class SimultaneousActivationByTypeFiltered(mesa.time.SimultaneousActivation):
         super().add(agent)
         agent_class: type[Agent] = type(agent)
         self.agents_by_type[agent_class][agent.unique_id] = agent
+        key = next(self._sequence)
+        self._all[agent.unique_id] = agent
+        self._order[agent.unique_id] = key
+        self._activation.append(agent)
+        self._keys.append(key)
 
     def remove(self, agent: Agent) -> None:
         """
         Remove all instances of a given agent from the schedule.
         """
 
-        del self._agents[agent.unique_id]
+        if agent.unique_id in self._inactive:
+            del self._inactive[agent.unique_id]
+        else:
+            del self._agents[agent.unique_id]
+            self._unlist(agent)
+        del self._all[agent.unique_id]
+        del self._order[agent.unique_id]
 
         agent_class: type[Agent] = type(agent)
         del self.agents_by_type[agent_class][agent.unique_id]
 
+    def deactivate(self, agent: Agent) -> None:
+        """
+        Stop stepping an agent while keeping it in agents and agents_by_type.
+        Not safe while the schedule is stepping.
+        """
+        self._inactive[agent.unique_id] = self._agents.pop(agent.unique_id)
+        self._unlist(agent)
+
+    def activate(self, agent: Agent) -> None:
+        """
+        Step a deactivated agent again, at its old place in the activation
+        order. Not safe while the schedule is stepping.
+        """
+        self._agents[agent.unique_id] = self._inactive.pop(agent.unique_id)
+        key = self._order[agent.unique_id]
+        index = bisect.bisect_left(self._keys, key)
+        self._keys.insert(index, key)
+        self._activation.insert(index, agent)
+
+    def _unlist(self, agent: Agent) -> None:
+        index = bisect.bisect_left(self._keys, self._order[agent.unique_id])
+        del self._keys[index]
+        del self._activation[index]
+
+    @property
+    def agents(self) -> list[Agent]:
+        """
+        All agents of the model, active or not, in the order they were added.
+        """
+        return list(self._all.values())
 
     def get_type_count(
         self,
@@ -56,4 +144,91 @@ class SimultaneousActivationByTypeFiltered(mesa.time.SimultaneousActivation):
         for agent in self.agents_by_type[type_class].values():
             if filter_func is None or filter_func(agent):
                 count += 1
-        return count
\ No newline at end of file
+        return count
+
+
+class TypePartitionedActivation(SimultaneousActivationByTypeFiltered):
+    """
+    Simultaneous activation over one contiguous partition per agent type.
+
+    The agents of each type sit in a list in the order they were added, with
+    agent.partition_index their slot and a bytearray of active flags next to
+    it. Types are activated in bulk in the order they were first added (every
+    step, then every advance), without walking the agent dicts. Removing an
+    agent leaves an empty slot and deactivating one clears its flag, so
+    indices stay stable within and across ticks; the commit phase compacts a
+    partition once more than half of it is empty, and bumps generation so
+    array kernels indexed by partition_index know to reindex.
+
+    Structural changes made while the partitions are being activated must be
+    queued with defer().
+
+    Example:
+    >>> scheduler = TypePartitionedActivation(model)
+    >>> citizens = scheduler.partitions[Citizen]
+    >>> active = np.frombuffer(scheduler.active[Citizen], dtype=bool)
+    """
+
+    def __init__(self, model: Model) -> None:
+        super().__init__(model)
+        self.partitions = {}
+        self.active = {}
+        self.generation = 0
+        self._empty_slots = defaultdict(int)
+
+    def add(self, agent: Agent) -> None:
+        super().add(agent)
+        agent_class: type[Agent] = type(agent)
+        partition = self.partitions.setdefault(agent_class, [])
+        agent.partition_index = len(partition)
+        partition.append(agent)
+        self.active.setdefault(agent_class, bytearray()).append(1)
+
+    def remove(self, agent: Agent) -> None:
+        super().remove(agent)
+        agent_class: type[Agent] = type(agent)
+        self.partitions[agent_class][agent.partition_index] = None
+        self.active[agent_class][agent.partition_index] = 0
+        self._empty_slots[agent_class] += 1
+
+    def deactivate(self, agent: Agent) -> None:
+        super().deactivate(agent)
+        self.active[type(agent)][agent.partition_index] = 0
+
+    def activate(self, agent: Agent) -> None:
+        super().activate(agent)
+        self.active[type(agent)][agent.partition_index] = 1
+
+    def step(self) -> None:
+        """
+        Step every active agent type by type, then advance them, then commit.
+        """
+        for agent_class, partition in self.partitions.items():
+            for agent in itertools.compress(partition, self.active[agent_class]):
+                agent.step()
+        for agent_class, partition in self.partitions.items():
+            for agent in itertools.compress(partition, self.active[agent_class]):
+                agent.advance()
+        self.steps += 1
+        self.time += 1
+        self.commit()
+
+    def commit(self) -> None:
+        super().commit()
+        for agent_class, empty in self._empty_slots.items():
+            if empty and 2 * empty > len(self.partitions[agent_class]):
+                self.compact(agent_class)
+
+    def compact(self, agent_class: Type[mesa.Agent]) -> None:
+        """
+        Close the empty slots of a partition, keeping the agents' order.
+        """
+        partition = self.partitions[agent_class]
+        active = self.active[agent_class]
+        kept = [i for i, agent in enumerate(partition) if agent is not None]
+        self.partitions[agent_class] = [partition[i] for i in kept]
+        self.active[agent_class] = bytearray(active[i] for i in kept)
+        for index, agent in enumerate(self.partitions[agent_class]):
+            agent.partition_index = index
+        self._empty_slots[agent_class] = 0
+        self.generation += 1
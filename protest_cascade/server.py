@@ -1,9 +1,8 @@
-import mesa
-
 from .model import ProtestCascade
-from .agent import Citizen, Security
+from .trajectory import TrajectoryReplay
 from mesa.visualization.UserParam import Slider, NumberInput, Checkbox
-from mesa.visualization.modules import ChartModule, TextElement
+from mesa.visualization.modules import CanvasGrid, ChartModule, TextElement
+from mesa.visualization.ModularVisualization import ModularServer
 
 
 AGENT_SUPPORT_COLOR = "#648FFF"
@@ -32,10 +31,10 @@ class SupportChart(TextElement):
 
 
 class JailChart(TextElement):
-    """Display the current publicly (regime) supporting population."""
+    """Display the current jailed population."""
 
     def render(self, model):
-        return f"Supporting Population: {model.jail_count}"
+        return f"Jailed Population: {model.jail_count}"
 
 
 citizen_chart = CitizenChart()
@@ -64,10 +63,13 @@ def portrayal(agent):
     if agent is None:
         return
 
-    if type(agent) is Security and agent.defected:
+    # replayed agents carry their recorded type as kind
+    kind = getattr(agent, "kind", type(agent).__name__)
+
+    if kind == "Security" and agent.defected:
         return
 
-    if type(agent) is Citizen and agent.condition == "Jail":
+    if kind == "Citizen" and agent.condition == "Jail":
         return
 
     portrayal = {
@@ -77,7 +79,7 @@ def portrayal(agent):
         "Filled": "true",
     }
 
-    if type(agent) is Citizen:
+    if kind == "Citizen":
         color = (
             AGENT_SUPPORT_COLOR if agent.condition == "Support" else AGENT_OPPOSE_COLOR
         )
@@ -87,7 +89,7 @@ def portrayal(agent):
         portrayal["Filled"] = "false"
         portrayal["Layer"] = 0
 
-    if type(agent) is Security:
+    if kind == "Security":
         portrayal["Shape"] = "rect"
         portrayal["w"] = 0.8
         portrayal["h"] = 0.8
@@ -114,8 +116,8 @@ model_params = dict(
     multiple_agents_per_cell=Checkbox("Multiple Agents Per Cell", value=False),
     seed=NumberInput("User Chosen Fixed Seed", value=42),
 )
-canvas_element = mesa.visualization.CanvasGrid(portrayal, 40, 40, 480, 480)
-server = mesa.visualization.ModularServer(
+canvas_element = CanvasGrid(portrayal, 40, 40, 480, 480)
+server = ModularServer(
     ProtestCascade,
     [
         canvas_element,
@@ -127,4 +129,26 @@ server = mesa.visualization.ModularServer(
     ],
     "Protest Cascade",
     model_params,
-)
\ No newline at end of file
+)
+
+
+def replay_server(path):
+    """
+    Server that plays back a recorded trajectory store instead of running
+    the model.
+    """
+    replay = TrajectoryReplay(path)
+    canvas = CanvasGrid(portrayal, replay.width, replay.height, 480, 480)
+    return ModularServer(
+        TrajectoryReplay,
+        [
+            canvas,
+            citizen_chart,
+            protest_chart,
+            support_chart,
+            count_chart,
+            chart_spread_speed,
+        ],
+        "Protest Cascade (replay)",
+        {"path": path},
+    )
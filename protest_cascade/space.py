@@ -0,0 +1,290 @@
+"""
+Precomputed neighborhood stencils for the torus grid.
+
+MultiGrid.get_neighborhood rebuilds the wrapped coordinate list of a cell
+(and then memoizes it per cell in an unbounded dict), and
+get_cell_list_contents walks those coordinates through __getitem__ and
+is_cell_empty. On a torus every cell's neighborhood is a translation of the
+same offset table, so StencilCache builds, for each (radius, moore,
+include_center), one int32 array of shape (cells, k) holding the flat indices
+x * height + y of every cell's neighborhood, sorted so that they come out in
+exactly the order mesa returns them. Neighbor lookups then become a row slice
+plus a walk over the flat list of cell contents.
+
+Tables are kept in least recently used order within a byte budget. A table
+that alone would exceed the budget is never built; its rows are computed
+from the offsets on every lookup instead, which is slower but keeps memory
+bounded.
+
+Legacy placement draws random.choice(list(grid.empties)) for every agent,
+which lists the whole set each time and makes construction quadratic.
+EmptyCellOrder answers the same indexing in O(log n) while cells are only
+being filled, so the draws, and the results, stay exactly the same.
+"""
+import itertools
+import logging as log
+import operator
+from collections import OrderedDict
+
+import mesa
+import numpy as np
+
+
+class StencilCache:
+    """
+    Flat-index neighborhood tables of a width x height torus.
+
+    max_bytes: budget for the tables kept; least recently used tables are
+               dropped (and rebuilt on demand) once it is exceeded, and a
+               table larger than the whole budget is not built at all
+    """
+
+    def __init__(self, width, height, max_bytes=64 * 2**20):
+        self.width = width
+        self.height = height
+        self.max_bytes = max_bytes
+        self._tables = OrderedDict()
+        self._offsets = {}
+        self.builds = 0
+        self.oversized = set()
+
+    def offsets(self, radius, moore=True, include_center=False):
+        """
+        Distinct (dx, dy) offsets of a neighborhood, wrapped onto the torus.
+        """
+        span = np.arange(-radius, radius + 1)
+        dx, dy = np.meshgrid(span, span, indexing="ij")
+        dx, dy = dx.ravel(), dy.ravel()
+        if not moore:
+            keep = np.abs(dx) + np.abs(dy) <= radius
+            dx, dy = dx[keep], dy[keep]
+        wrapped = np.unique(
+            np.stack([dx % self.width, dy % self.height], axis=1), axis=0
+        )
+        if not include_center:
+            wrapped = wrapped[(wrapped[:, 0] != 0) | (wrapped[:, 1] != 0)]
+        return wrapped
+
+    def cached_offsets(self, radius, moore=True, include_center=False):
+        """
+        offsets(), kept per neighborhood; they are small even when the
+        table is not.
+        """
+        key = (radius, moore, include_center)
+        offsets = self._offsets.get(key)
+        if offsets is None:
+            offsets = self.offsets(radius, moore, include_center)
+            self._offsets[key] = offsets
+        return offsets
+
+    def table(self, radius, moore=True, include_center=False):
+        """
+        (cells, k) int32 array; row x * height + y holds the sorted flat
+        indices of the neighborhood of (x, y). None if the table alone would
+        exceed max_bytes.
+        """
+        key = (radius, moore, include_center)
+        table = self._tables.get(key)
+        if table is not None:
+            self._tables.move_to_end(key)
+            return table
+        if key in self.oversized:
+            return None
+
+        offsets = self.cached_offsets(radius, moore, include_center)
+        nbytes = self.width * self.height * len(offsets) * np.dtype(np.int32).itemsize
+        if nbytes > self.max_bytes:
+            self.oversized.add(key)
+            log.warning(
+                "Stencil table radius=%s moore=%s include_center=%s needs %s "
+                "bytes, more than stencil_cache_bytes=%s; computing "
+                "neighborhoods per lookup instead",
+                radius,
+                moore,
+                include_center,
+                nbytes,
+                self.max_bytes,
+            )
+            return None
+
+        x, y = np.divmod(np.arange(self.width * self.height), self.height)
+        nx = (x[:, None] + offsets[:, 0]) % self.width
+        ny = (y[:, None] + offsets[:, 1]) % self.height
+        table = np.sort(nx * self.height + ny, axis=1).astype(np.int32)
+        table.flags.writeable = False
+
+        self._tables[key] = table
+        self.builds += 1
+        while self.nbytes > self.max_bytes and len(self._tables) > 1:
+            self._tables.popitem(last=False)
+        return table
+
+    def row(self, pos, radius, moore=True, include_center=False):
+        """
+        Sorted flat indices of the neighborhood of pos, from the table if it
+        fits the budget, computed from the offsets otherwise.
+        """
+        x, y = pos
+        table = self.table(radius, moore, include_center)
+        if table is not None:
+            return table[x * self.height + y]
+        offsets = self.cached_offsets(radius, moore, include_center)
+        nx = (x + offsets[:, 0]) % self.width
+        ny = (y + offsets[:, 1]) % self.height
+        return np.sort(nx * self.height + ny)
+
+    @property
+    def nbytes(self):
+        """
+        Bytes held by the cached tables.
+        """
+        return sum(table.nbytes for table in self._tables.values())
+
+    def info(self):
+        """
+        Report of the cached tables and their memory use.
+        """
+        return {
+            "tables": {
+                f"radius={r} moore={m} include_center={c}": table.shape
+                for (r, m, c), table in self._tables.items()
+            },
+            "nbytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "builds": self.builds,
+            "oversized": sorted(self.oversized),
+        }
+
+
+class EmptyCellOrder:
+    """
+    Indexable view of a set of cells in the order list(cells) gives, kept
+    current while cells are only discarded from the set.
+
+    A set never rehashes on discard, so the cells left keep their relative
+    iteration order; the k-th of them is found in a Fenwick tree of counts
+    over the original order instead of by listing the set.
+    """
+
+    def __init__(self, cells):
+        self._cells = list(cells)
+        self._index = {cell: i for i, cell in enumerate(self._cells)}
+        n = len(self._cells)
+        tree = [0] * (n + 1)
+        for i in range(1, n + 1):
+            tree[i] += 1
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self._tree = tree
+        self._size = n
+        self._top = 1 << (n.bit_length() - 1) if n else 0
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, k):
+        if not 0 <= k < self._size:
+            raise IndexError("empty cell index out of range")
+        tree, n = self._tree, len(self._cells)
+        position, remaining, bit = 0, k + 1, self._top
+        while bit:
+            following = position + bit
+            if following <= n and tree[following] < remaining:
+                position = following
+                remaining -= tree[following]
+            bit >>= 1
+        return self._cells[position]
+
+    def discard(self, cell):
+        i = self._index.pop(cell, None)
+        if i is None:
+            return
+        self._size -= 1
+        tree, n = self._tree, len(self._cells)
+        i += 1
+        while i <= n:
+            tree[i] -= 1
+            i += i & -i
+
+
+class StencilGrid(mesa.space.MultiGrid):
+    """
+    Toroidal MultiGrid whose neighborhood queries are answered from a
+    StencilCache. Results are identical to MultiGrid's, in the same order.
+    """
+
+    def __init__(self, width, height, torus=True, max_bytes=64 * 2**20):
+        if not torus:
+            raise ValueError("StencilGrid only supports toroidal grids")
+        super().__init__(width, height, torus)
+        self.stencils = StencilCache(width, height, max_bytes)
+        # flat views sharing the cell lists of self.grid
+        self._cells = [self.grid[x][y] for x in range(width) for y in range(height)]
+        self._coords = [(x, y) for x in range(width) for y in range(height)]
+        self._empty_order = None
+
+    def place_agent(self, agent, pos):
+        super().place_agent(agent, pos)
+        if self._empty_order is not None:
+            self._empty_order.discard(pos)
+
+    def remove_agent(self, agent):
+        pos = agent.pos
+        super().remove_agent(agent)
+        # a cell added back to the set can change its iteration order
+        if self._empty_order is not None and pos in self.empties:
+            self._empty_order = None
+
+    def empty_cells(self):
+        """
+        The empty cells as an indexable sequence in list(self.empties) order,
+        maintained in O(log n) per placement until a cell is emptied again.
+        """
+        if self._empty_order is None:
+            self._empty_order = EmptyCellOrder(self.empties)
+        return self._empty_order
+
+    def choose_empty(self, rng, ordered=False):
+        """
+        rng.choice(list(self.empties)), or rng.choice(sorted(self.empties))
+        if ordered: the same draw and the same cell, found by walking the set
+        (or the cells in coordinate order) to it instead of listing or
+        sorting it.
+        """
+        count = len(self.empties)
+        if not count:
+            raise IndexError("Cannot choose from an empty sequence")
+        # choice(seq) is seq[randrange(len(seq))]
+        index = rng.randrange(count)
+        if ordered:
+            cells = itertools.compress(self._coords, map(operator.not_, self._cells))
+        else:
+            cells = self.empties
+        return next(itertools.islice(cells, index, None))
+
+    def get_neighborhood(self, pos, moore, include_center=False, radius=1):
+        """
+        Coordinates of the neighborhood of pos, as MultiGrid returns them.
+        """
+        row = self.stencils.row(pos, radius, moore, include_center)
+        coords = self._coords
+        return [coords[i] for i in row.tolist()]
+
+    def get_neighborhood_contents(
+        self, pos, moore=True, radius=1, include_center=False
+    ):
+        """
+        Agents in the neighborhood of pos; the same list as
+        get_cell_list_contents(get_neighborhood(...)).
+        """
+        row = self.stencils.row(pos, radius, moore, include_center)
+        cells = self._cells
+        return [agent for i in row.tolist() for agent in cells[i]]
+
+    def log_stencil_memory(self):
+        """
+        Log the stencil cache report at debug level.
+        """
+        if log.getLogger().isEnabledFor(log.DEBUG):
+            log.debug("Stencil cache %s", self.stencils.info())
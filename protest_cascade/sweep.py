@@ -0,0 +1,533 @@
+"""
+Shardable parameter sweeps driven by a grid file.
+
+The grid file is JSON:
+
+    {
+        "max_steps": 200,
+        "fixed": {"multiple_agents_per_cell": true},
+        "grid": [
+            {
+                "seed": [287, 298],
+                "private_preference_distribution_mean": [-1, 0, 1],
+                "security_density": [0.0, 0.04],
+                "epsilon": [0, 0.5, 1]
+            }
+        ]
+    }
+
+Every block of "grid" is expanded to the product of its value lists and the
+blocks are concatenated in file order; duplicate points are dropped. Point i of
+that list belongs to shard i % shard_count, so every machine given the same
+file and a different --shard-index runs a disjoint slice and together they
+cover the grid. "fixed" may set agent_collection with the specs understood by
+collection.policy_from_spec, "trajectory": true to write each run's
+memory-mapped trajectory store under <out>/trajectory, and memory_profile (a
+step policy spec) to write per-run tracemalloc snapshots under <out>/memory.
+
+With "crn": true in the grid file (or run --crn) the sweep uses common random
+numbers: every run gets rng="streams", so all points that share a seed draw
+the same standard normal preferences, epsilon noise, cell permutation and
+per-agent movement streams, and only the parameters transform those draws.
+Differences between neighboring points then reflect the parameters rather
+than seed noise. The report step measures the reduction: for each pair of
+neighboring values along a swept parameter it compares Var(Ya - Yb) across
+seeds with Var(Ya) + Var(Yb), the variance of the difference had the two
+points been run with independent draws.
+
+Each run writes the usual per-run CSVs under <out>/model and <out>/agent and
+appends its final model reporters to <out>/shards/shard-<i>-of-<n>.csv. The
+merge step combines the shard files into <out>/sweep.csv and checks that every
+point of the grid is present exactly once.
+
+Usage:
+    $ python -m protest_cascade.sweep run sweeps/default.json --shard-index 0 --shard-count 4
+    $ python -m protest_cascade.sweep merge sweeps/default.json
+    $ python -m protest_cascade.sweep report sweeps/crn.json --metric "Protest Count"
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import inspect
+import json
+import logging as log
+import math
+import os
+import sys
+from itertools import product
+from multiprocessing import Pool, Queue
+
+import pandas as pd
+
+from .headless import headless_mesa
+
+# shards start without mesa's visualization, see headless.py
+headless_mesa()
+
+from .collection import policy_from_spec
+from .logs import configure_logging, configure_worker_logging
+from .metrics import MetricsRegistry, serve_metrics, start_recorder
+from .model import ProtestCascade
+from .population import TEMPLATES
+
+# parameters named in the per-run file names, with their file name prefix
+FILE_PARAMETERS = {
+    "seed": "seed_",
+    "private_preference_distribution_mean": "pp_",
+    "security_density": "sd",
+    "epsilon": "ep_",
+}
+
+
+def load_grid(path):
+    """
+    Read a grid file.
+    """
+    with open(path) as f:
+        grid = json.load(f)
+    grid.setdefault("fixed", {})
+    grid.setdefault("max_steps", 200)
+    grid.setdefault("crn", False)
+    return grid
+
+
+def run_fixed(grid):
+    """
+    The fixed parameters of every run; common random numbers need the
+    per-purpose streams, so crn grids run with rng="streams".
+    """
+    fixed = dict(grid["fixed"])
+    if grid.get("crn"):
+        if fixed.get("rng", "streams") != "streams":
+            log.warning(
+                "crn sweep overrides fixed rng=%r with rng='streams'", fixed["rng"]
+            )
+        fixed["rng"] = "streams"
+    return fixed
+
+
+def dict_product(dicts):
+    """
+    >>> list(dict_product(dict(number=[1,2], character='ab')))
+    [{'number': 1, 'character': 'a'},
+     {'number': 1, 'character': 'b'},
+     {'number': 2, 'character': 'a'},
+     {'number': 2, 'character': 'b'}]
+    """
+    return (dict(zip(dicts, x)) for x in product(*dicts.values()))
+
+
+def point_id(point):
+    """
+    Stable identifier of a parameter point, independent of key order.
+    """
+    canonical = json.dumps(point, sort_keys=True)
+    return hashlib.sha1(canonical.encode()).hexdigest()[:12]
+
+
+def expand_grid(grid):
+    """
+    All distinct points of the grid, in file order.
+    """
+    points = []
+    seen = set()
+    for block in grid["grid"]:
+        for point in dict_product(block):
+            pid = point_id(point)
+            if pid in seen:
+                log.warning("Dropping duplicate grid point %s", point)
+                continue
+            seen.add(pid)
+            points.append(point)
+    return points
+
+
+def shard_points(points, shard_index, shard_count):
+    """
+    The deterministic, disjoint slice of points run by one shard.
+    """
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"shard index {shard_index} not in [0, {shard_count})")
+    return [p for i, p in enumerate(points) if i % shard_count == shard_index]
+
+
+def run_stem(point):
+    """
+    File name stem of a run, e.g. seed_287_pp_-1_sd0.0_ep_0; parameters not
+    in FILE_PARAMETERS are appended as _<name>_<value>.
+    """
+    stem = "_".join(
+        f"{prefix}{point[name]}"
+        for name, prefix in FILE_PARAMETERS.items()
+        if name in point
+    )
+    extra = "".join(
+        f"_{name}_{value}"
+        for name, value in point.items()
+        if name not in FILE_PARAMETERS
+    )
+    return stem + extra
+
+
+def run_point(point, fixed, max_steps, out):
+    """
+    Run one parameter point, write its per-run CSVs and return its summary
+    row: the point's id and parameters followed by the final model reporters.
+    """
+    kwargs = {**fixed, **point}
+    seed_dir = f"seed_{kwargs.get('seed')}"
+    stem = run_stem(point)
+    if "agent_collection" in kwargs:
+        kwargs["agent_collection"] = policy_from_spec(kwargs["agent_collection"])
+    if kwargs.get("memory_profile") is not None:
+        kwargs["memory_profile"] = policy_from_spec(kwargs["memory_profile"])
+    if kwargs.get("trajectory") is True:
+        kwargs["trajectory"] = os.path.join(out, "trajectory", seed_dir, stem)
+        kwargs.setdefault("trajectory_steps", max_steps + 1)
+    model = ProtestCascade(**kwargs)
+    while model.running and model.schedule.steps < max_steps:
+        model.step()
+    model.close()
+
+    model_df = model.datacollector.get_model_vars_dataframe()
+    agent_df = model.datacollector.get_agent_vars_dataframe()
+    for kind, df in (("model", model_df), ("agent", agent_df)):
+        directory = os.path.join(out, kind, seed_dir)
+        os.makedirs(directory, exist_ok=True)
+        df.to_csv(os.path.join(directory, f"{kind}_{stem}.csv"))
+    with open(
+        os.path.join(out, "agent", seed_dir, f"agent_{stem}.sampling.json"), "w"
+    ) as f:
+        json.dump(agent_df.attrs.get("sampling", {}), f, indent=2)
+    if model.memory_profile is not None:
+        directory = os.path.join(out, "memory", seed_dir)
+        os.makedirs(directory, exist_ok=True)
+        model.memory_profile.dataframe().to_csv(
+            os.path.join(directory, f"memory_{stem}.csv")
+        )
+
+    log.info("Finished point %s after %s steps", point_id(point), model.schedule.steps)
+    final = model_df.iloc[-1].to_dict()
+    return {
+        "point_id": point_id(point),
+        **point,
+        "Steps": model.schedule.steps,
+        **final,
+    }
+
+
+def warm_population_templates(points, fixed):
+    """
+    Build the population templates of points in this process, so that
+    forked workers share them copy-on-write instead of each drawing its own.
+    """
+    defaults = {
+        name: parameter.default
+        for name, parameter in inspect.signature(ProtestCascade).parameters.items()
+    }
+    keys = []
+    for point in points:
+        params = {**defaults, **fixed, **point}
+        if (
+            params["seed"] is None
+            or params["random_seed"]
+            or not params["population_template"]
+        ):
+            continue
+        width, height = params["width"], params["height"]
+        keys.append(
+            (
+                params["seed"],
+                width,
+                height,
+                round(width * height * params["citizen_density"]),
+                params["multiple_agents_per_cell"],
+                params["rng"],
+            )
+        )
+    TEMPLATES.warm(keys)
+
+
+def _run_point(args):
+    return run_point(*args)
+
+
+def _init_worker(log_dir, stem, metrics_queue):
+    configure_worker_logging(log_dir, stem)
+    if metrics_queue is not None:
+        start_recorder(metrics_queue)
+
+
+def shard_path(out, shard_index, shard_count):
+    """
+    Path of a shard's result file.
+    """
+    return os.path.join(
+        out, "shards", f"shard-{shard_index:03d}-of-{shard_count:03d}.csv"
+    )
+
+
+def run_shard(
+    grid, shard_index=0, shard_count=1, out="data", processes=1, metrics_port=None
+):
+    """
+    Run this shard's points, appending each finished point to the shard file.
+
+    With metrics_port the shard's live metrics are served on
+    http://127.0.0.1:<metrics_port>/metrics, see metrics.py.
+    """
+    points = shard_points(expand_grid(grid), shard_index, shard_count)
+    log.info("Shard %s of %s running %s points", shard_index, shard_count, len(points))
+    path = shard_path(out, shard_index, shard_count)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fixed = run_fixed(grid)
+    log.info("Common random numbers %s", "on" if grid.get("crn") else "off")
+    jobs = [(point, fixed, grid["max_steps"], out) for point in points]
+    warm_population_templates(points, fixed)
+
+    metrics_queue = None
+    if metrics_port is not None:
+        registry = MetricsRegistry(runs_planned=len(points))
+        serve_metrics(registry, metrics_port)
+        if processes == 1:
+            start_recorder(registry)
+        else:
+            metrics_queue = Queue()
+            registry.listen(metrics_queue)
+
+    with open(path, "w", newline="") as f:
+        writer = None
+
+        def write(row):
+            nonlocal writer
+            if writer is None:
+                writer = csv.DictWriter(f, fieldnames=list(row))
+                writer.writeheader()
+            writer.writerow(row)
+            f.flush()
+
+        if processes == 1:
+            for job in jobs:
+                write(_run_point(job))
+        else:
+            log_dir = os.path.join(os.getcwd(), "log")
+            with Pool(
+                processes,
+                initializer=_init_worker,
+                initargs=(log_dir, f"sweep-shard-{shard_index}", metrics_queue),
+            ) as pool:
+                for row in pool.imap_unordered(_run_point, jobs):
+                    write(row)
+    return path
+
+
+def merge_shards(grid, out="data"):
+    """
+    Combine all shard files under out into one table in grid order.
+
+    Returns (merged, missing, duplicates) where missing lists the grid points
+    without a result and duplicates the point ids found more than once.
+    """
+    points = expand_grid(grid)
+    files = sorted(glob.glob(os.path.join(out, "shards", "shard-*.csv")))
+    # point ids are hex digests, some of which would parse as numbers
+    frames = [
+        pd.read_csv(path, dtype={"point_id": str}).assign(shard=os.path.basename(path))
+        for path in files
+    ]
+    results = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    present = results["point_id"] if len(results) else pd.Series(dtype=str)
+    duplicates = sorted(present[present.duplicated()].unique())
+    found = set(present)
+    missing = [point for point in points if point_id(point) not in found]
+
+    order = {point_id(point): i for i, point in enumerate(points)}
+    if len(results):
+        results = results.drop_duplicates("point_id", keep="first")
+        results = results[results["point_id"].isin(order)]
+        results = results.sort_values("point_id", key=lambda ids: ids.map(order))
+    return results.reset_index(drop=True), missing, duplicates
+
+
+def crn_report(merged, grid, metrics=("Protest Count",), replicate="seed"):
+    """
+    Variance of the difference between neighboring grid points.
+
+    For every swept parameter, every pair of adjacent values (a, b) and every
+    setting of the other parameters ("at"), the replicates (seeds) run at
+    both points are paired and each metric Y gives one row with:
+
+        var_diff         Var(Ya - Yb) over the paired replicates
+        var_independent  Var(Ya) + Var(Yb), Var(Ya - Yb) without shared draws
+        reduction        1 - var_diff / var_independent
+        replicate_factor var_independent / var_diff, how many times the
+                         replicates independent runs need for the same
+                         standard error of the difference
+    """
+    columns = [
+        "parameter",
+        "a",
+        "b",
+        "at",
+        "metric",
+        "replicates",
+        "var_diff",
+        "var_independent",
+        "reduction",
+        "replicate_factor",
+    ]
+    swept = {name for block in grid["grid"] for name in block} - {replicate}
+    parameters = [
+        name for name in merged.columns if name in swept and merged[name].nunique() > 1
+    ]
+    rows = []
+    for parameter in parameters:
+        others = [name for name in parameters if name != parameter]
+        values = sorted(merged[parameter].unique())
+        for a, b in zip(values, values[1:]):
+            at_a = merged[merged[parameter] == a]
+            at_b = merged[merged[parameter] == b]
+            paired = at_a.merge(at_b, on=others + [replicate], suffixes=("_a", "_b"))
+            if not len(paired):
+                continue
+            groups = paired.groupby(others) if others else [((), paired)]
+            for key, group in groups:
+                if len(group) < 2:
+                    continue
+                key = key if isinstance(key, tuple) else (key,)
+                at = " ".join(f"{name}={value}" for name, value in zip(others, key))
+                for metric in metrics:
+                    ya, yb = group[f"{metric}_a"], group[f"{metric}_b"]
+                    var_diff = (ya - yb).var()
+                    var_independent = ya.var() + yb.var()
+                    rows.append(
+                        [
+                            parameter,
+                            a,
+                            b,
+                            at,
+                            metric,
+                            len(group),
+                            var_diff,
+                            var_independent,
+                            1 - var_diff / var_independent
+                            if var_independent
+                            else math.nan,
+                            var_independent / var_diff if var_diff else math.inf,
+                        ]
+                    )
+    return pd.DataFrame(rows, columns=columns)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run a parameter sweep shard, or merge shard outputs."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run one shard of a grid file")
+    run.add_argument("grid", help="JSON grid file")
+    run.add_argument("--shard-index", type=int, default=0)
+    run.add_argument("--shard-count", type=int, default=1)
+    run.add_argument("--out", default="data", help="output directory")
+    run.add_argument("--processes", type=int, default=1)
+    run.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="serve live metrics on this local port (/metrics, /metrics.json)",
+    )
+    run.add_argument(
+        "--crn",
+        action="store_true",
+        help='use common random numbers across points, as "crn": true does',
+    )
+
+    merge = commands.add_parser("merge", help="merge shard outputs of a grid file")
+    merge.add_argument("grid", help="JSON grid file")
+    merge.add_argument("--out", default="data", help="output directory")
+    merge.add_argument(
+        "--allow-missing",
+        action="store_true",
+        help="write the merged table even if points are missing or duplicated",
+    )
+
+    report = commands.add_parser(
+        "report", help="variance reduction of a merged (crn) sweep"
+    )
+    report.add_argument("grid", help="JSON grid file")
+    report.add_argument("--out", default="data", help="output directory")
+    report.add_argument(
+        "--metric",
+        action="append",
+        help="final model reporter to compare (repeatable), default Protest Count",
+    )
+
+    args = parser.parse_args(argv)
+    grid = load_grid(args.grid)
+
+    if args.command == "report":
+        merged = pd.read_csv(
+            os.path.join(args.out, "sweep.csv"), dtype={"point_id": str}
+        )
+        table = crn_report(merged, grid, args.metric or ["Protest Count"])
+        path = os.path.join(args.out, "crn_report.csv")
+        table.to_csv(path, index=False)
+        if not len(table):
+            print(
+                "No neighboring points with two or more paired seeds", file=sys.stderr
+            )
+            return 1
+        summary = table.groupby(["parameter", "metric"])[
+            ["var_diff", "var_independent"]
+        ].sum()
+        for (parameter, metric), row in summary.iterrows():
+            reduction = 1 - row["var_diff"] / row["var_independent"]
+            print(
+                f"{parameter} / {metric}: Var(Ya - Yb) {row['var_diff']:.4g} vs "
+                f"{row['var_independent']:.4g} independent, "
+                f"variance reduction {reduction:.1%}"
+            )
+        print(f"Wrote {path}")
+        return 0
+
+    if args.command == "run":
+        grid["crn"] = grid["crn"] or args.crn
+        configure_logging(
+            os.path.join(
+                "log", f"sweep-shard-{args.shard_index}-of-{args.shard_count}.jsonl"
+            )
+        )
+        path = run_shard(
+            grid,
+            args.shard_index,
+            args.shard_count,
+            args.out,
+            args.processes,
+            args.metrics_port,
+        )
+        print(f"Wrote {path}")
+        return 0
+
+    merged, missing, duplicates = merge_shards(grid, args.out)
+    for point in missing:
+        print(f"missing point {point_id(point)}: {json.dumps(point)}", file=sys.stderr)
+    for pid in duplicates:
+        print(f"duplicate point {pid}", file=sys.stderr)
+    if (missing or duplicates) and not args.allow_missing:
+        print(
+            f"{len(missing)} missing and {len(duplicates)} duplicated points, "
+            "not writing merged output",
+            file=sys.stderr,
+        )
+        return 1
+    path = os.path.join(args.out, "sweep.csv")
+    merged.to_csv(path, index=False)
+    print(f"Merged {len(merged)} points into {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+"""
+Memory-mapped agent trajectory store.
+
+A trajectory is a directory holding one .npy file per field, each a
+fixed-dtype steps x agents array, plus header.json describing the run:
+
+    header.json        params, agent_ids, agent column order, steps_written
+    x.npy, y.npy       int16, -1 while the agent is off the grid
+    condition.npy      int8 code of agent.CONDITIONS
+    agent_type.npy     int8 index of AGENT_TYPES
+    opinion.npy        float32, NaN where undefined
+    activation.npy     float32, NaN where undefined
+    jail_sentence.npy  int16
+    flip.npy           int8
+
+The model writes one row per step straight into the mapped files. Readers
+open them with numpy's mmap_mode, so slicing a step (a row) or an agent (a
+column) reads only those pages and copies nothing.
+
+Example:
+>>> store = TrajectoryStore("data/trajectory/seed_1")
+>>> protesting = (store["condition"] == CONDITION_CODES["Protest"]).sum(axis=1)
+>>> x, y = store.step(37)["x"], store.step(37)["y"]
+"""
+import json
+import logging as log
+import math
+import os
+
+import mesa
+import numpy as np
+
+from .agent import CONDITION_CODES, CONDITIONS, Security
+
+FIELDS = {
+    "x": np.int16,
+    "y": np.int16,
+    "condition": np.int8,
+    "agent_type": np.int8,
+    "opinion": np.float32,
+    "activation": np.float32,
+    "jail_sentence": np.int16,
+    "flip": np.int8,
+}
+AGENT_TYPES = ("Citizen", "Security")
+
+
+class TrajectoryWriter:
+    """
+    Write agent state rows into a new trajectory directory.
+
+    path: directory to create (existing field files are overwritten)
+    capacity: number of steps to allocate, including step 0
+    agents: the agents to follow, one column each in unique_id order
+    params: JSON serializable run parameters stored in the header
+    """
+
+    def __init__(self, path, capacity, agents, params, header_interval=50):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.capacity = capacity
+        self.header_interval = header_interval
+        self.agent_ids = sorted(agent.unique_id for agent in agents)
+        self.columns = {uid: i for i, uid in enumerate(self.agent_ids)}
+        self.steps_written = 0
+        self.params = params
+        self._warned = False
+        shape = (capacity, len(self.agent_ids))
+        self.fields = {
+            name: np.lib.format.open_memmap(
+                os.path.join(path, f"{name}.npy"), mode="w+", dtype=dtype, shape=shape
+            )
+            for name, dtype in FIELDS.items()
+        }
+        self.write_header()
+
+    def write(self, step, agents):
+        """
+        Write the state of agents as row step.
+        """
+        if step >= self.capacity:
+            if not self._warned:
+                log.warning(
+                    "Trajectory %s is full at %s steps, later steps are dropped",
+                    self.path,
+                    self.capacity,
+                )
+                self._warned = True
+            return
+
+        columns, xs, ys, conditions, types = [], [], [], [], []
+        opinions, activations, sentences, flips = [], [], [], []
+        nan = math.nan
+        for agent in agents:
+            columns.append(self.columns[agent.unique_id])
+            pos = agent.pos
+            if pos is None:
+                xs.append(-1)
+                ys.append(-1)
+            else:
+                xs.append(pos[0])
+                ys.append(pos[1])
+            conditions.append(CONDITION_CODES.get(agent.condition, 0))
+            types.append(1 if isinstance(agent, Security) else 0)
+            opinion = getattr(agent, "opinion", None)
+            opinions.append(nan if opinion is None else opinion)
+            activation = getattr(agent, "activation", None)
+            activations.append(nan if activation is None else activation)
+            sentences.append(getattr(agent, "jail_sentence", 0))
+            flips.append(1 if getattr(agent, "flip", False) else 0)
+
+        fields = self.fields
+        fields["x"][step, columns] = xs
+        fields["y"][step, columns] = ys
+        fields["condition"][step, columns] = conditions
+        fields["agent_type"][step, columns] = types
+        fields["opinion"][step, columns] = opinions
+        fields["activation"][step, columns] = activations
+        fields["jail_sentence"][step, columns] = sentences
+        fields["flip"][step, columns] = flips
+
+        self.steps_written = max(self.steps_written, step + 1)
+        if step % self.header_interval == 0:
+            self.write_header()
+
+    def write_header(self):
+        """
+        Write header.json, recording how many steps are valid.
+        """
+        header = {
+            "version": 1,
+            "steps_written": self.steps_written,
+            "capacity": self.capacity,
+            "agent_ids": self.agent_ids,
+            "fields": {name: np.dtype(dtype).str for name, dtype in FIELDS.items()},
+            "conditions": list(CONDITIONS),
+            "agent_types": list(AGENT_TYPES),
+            "params": self.params,
+        }
+        with open(os.path.join(self.path, "header.json"), "w") as f:
+            json.dump(header, f, indent=2, default=str)
+
+    def close(self):
+        """
+        Flush the mapped files and the final header.
+        """
+        for array in self.fields.values():
+            array.flush()
+        self.write_header()
+
+
+class TrajectoryStore:
+    """
+    Zero-copy reader of a trajectory directory.
+
+    store["opinion"] is the steps_written x agents memory-mapped array;
+    store.step(t) and store.agent(unique_id) return views of one row or one
+    column of every field.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "header.json")) as f:
+            self.header = json.load(f)
+        self.params = self.header["params"]
+        self.agent_ids = self.header["agent_ids"]
+        self.columns = {uid: i for i, uid in enumerate(self.agent_ids)}
+        self.steps = self.header["steps_written"]
+        self._fields = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in self.header["fields"]
+        }
+
+    def __getitem__(self, field):
+        return self._fields[field][: self.steps]
+
+    @property
+    def fields(self):
+        return list(self._fields)
+
+    def step(self, step):
+        """
+        Row views of every field at step.
+        """
+        return {name: array[step] for name, array in self._fields.items()}
+
+    def agent(self, unique_id):
+        """
+        Column views of every field for one agent, over the written steps.
+        """
+        column = self.columns[unique_id]
+        return {name: self[name][:, column] for name in self._fields}
+
+
+class ReplayAgent(mesa.Agent):
+    """
+    Stand-in agent placed on the replay grid; carries what the portrayal needs.
+    """
+
+    def __init__(self, unique_id, model, kind):
+        super().__init__(unique_id, model)
+        self.kind = kind
+        self.condition = None
+        self.defected = False
+
+
+class TrajectoryReplay(mesa.Model):
+    """
+    Model that steps through a recorded trajectory so the interactive
+    server can display it. Counts are computed from the mapped arrays.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.store = TrajectoryStore(path)
+        self.width = self.store.params["width"]
+        self.height = self.store.params["height"]
+        self.citizen_count = self.store.params.get("citizen_count")
+        self.grid = mesa.space.MultiGrid(self.width, self.height, torus=True)
+        self.schedule = mesa.time.BaseScheduler(self)
+        self.replay_agents = [
+            ReplayAgent(uid, self, None) for uid in self.store.agent_ids
+        ]
+        for agent in self.replay_agents:
+            self.schedule.add(agent)
+        self.datacollector = mesa.DataCollector(
+            model_reporters={
+                "Support Count": lambda m: m.count(CONDITION_CODES["Support"]),
+                "Protest Count": lambda m: m.count(CONDITION_CODES["Protest"]),
+                "Jail Count": lambda m: m.count(CONDITION_CODES["Jailed"]),
+                "Speed of Spread": lambda m: m.store["flip"][m.schedule.steps].sum()
+                / max(m.citizen_count or 1, 1),
+            }
+        )
+        self.show(0)
+        self.running = self.store.steps > 1
+        self.datacollector.collect(self)
+
+    def count(self, code):
+        """
+        Citizens in a condition at the current step.
+        """
+        row = self.store.step(self.schedule.steps)
+        citizens = row["agent_type"] == 0
+        return int(((row["condition"] == code) & citizens).sum())
+
+    @property
+    def protest_count(self):
+        return self.count(CONDITION_CODES["Protest"])
+
+    @property
+    def support_count(self):
+        return self.count(CONDITION_CODES["Support"])
+
+    @property
+    def jail_count(self):
+        return self.count(CONDITION_CODES["Jailed"])
+
+    def show(self, step):
+        """
+        Move the stand-in agents to their recorded state at step.
+        """
+        row = self.store.step(step)
+        for agent, x, y, code, kind in zip(
+            self.replay_agents,
+            row["x"].tolist(),
+            row["y"].tolist(),
+            row["condition"].tolist(),
+            row["agent_type"].tolist(),
+        ):
+            if agent.pos is not None:
+                self.grid.remove_agent(agent)
+            agent.kind = AGENT_TYPES[kind]
+            agent.condition = CONDITIONS[code]
+            if x >= 0:
+                self.grid.place_agent(agent, (x, y))
+
+    def step(self):
+        self.schedule.steps += 1
+        self.show(self.schedule.steps)
+        self.datacollector.collect(self)
+        if self.schedule.steps >= self.store.steps - 1:
+            self.running = False
@@ -1,18 +1,24 @@
-import logging as log
+import argparse
 import os
 
+from protest_cascade.logs import configure_logging
+
 cwd = os.getcwd()
-if not os.path.exists(os.path.join(cwd, "./log/")):
-    os.makedirs(os.path.join(cwd, "./log/"))
 
-# set up logging for the model
-log.basicConfig(
-    filename="./log/protest_cascade.log",
-    filemode="w",
-    format="%(message)s",
-    level=log.DEBUG,
+# set up logging for the model, JSON lines to file and run info to console
+configure_logging(
+    os.path.join(cwd, "log", "protest_cascade.jsonl"), level="DEBUG", console=True
+)
+
+parser = argparse.ArgumentParser(description="Launch the Protest Cascade server.")
+parser.add_argument(
+    "--replay", metavar="PATH", help="play back a recorded trajectory directory"
 )
+args = parser.parse_args()
 
-from protest_cascade.server import server
+from protest_cascade.server import replay_server, server
 
-server.launch()
+if args.replay:
+    replay_server(args.replay).launch()
+else:
+    server.launch()
@@ -1,33 +1,50 @@
+import json
 import logging as log
 import os
 
-# set up logging to output to cwd /data
-# log debug messages to file
-# info message to console
+# set up logging to output to cwd /log as JSON lines, formatted and written
+# off the simulation thread; set PROTEST_CASCADE_LOG_LEVEL=DEBUG for detail
 cwd = os.getcwd()
 log_path = os.path.join(cwd, "./log/")
-if not os.path.exists(log_path):
-    os.makedirs(log_path)
 
 data_path = os.path.join(cwd, "./data/")
 if not os.path.exists(data_path):
     os.makedirs(data_path)
 
+# import the simulation core without mesa's visualization
+from protest_cascade.headless import headless_mesa
+
+headless_mesa()
+
 from protest_cascade.model import ProtestCascade
 from mesa.batchrunner import FixedBatchRunner
 import pandas as pd
 from itertools import product
 from protest_cascade.agent import Citizen, Security
+from protest_cascade.logs import configure_logging
+from protest_cascade import metrics
 
-log.basicConfig(filename=f"{cwd}/log/batch.log", level=log.DEBUG)
+configure_logging(os.path.join(log_path, "batch.jsonl"), level="INFO")
 log.info("Starting batch run")
 
 # parameters that will remain constant
 fixed_parameters = {
     "multiple_agents_per_cell": True,
+    # agent-level collection, None records every agent at every step; to cut
+    # agent data volume give each reporter group its own policy from
+    # protest_cascade.collection, e.g.
+    # {"state": EveryKSteps(10), "traits": SnapshotSteps([0])}
+    # or {"state": OnStateChange(["condition", "pos"]), "traits": SnapshotSteps([0])}
+    "agent_collection": None,
+    # tracemalloc snapshots by agents, neighbor lists, grid, scheduler and
+    # collector at chosen steps, e.g. SnapshotSteps([0, 100, 200]) from
+    # protest_cascade.collection; slow, see protest_cascade/memprofile.py
+    "memory_profile": None,
 }
 
 # parameter sweep
+# for sweeps split across machines use the grid files in sweeps/ with
+# python -m protest_cascade.sweep, see README.md
 # params = [
 #     {
 #         "seed": [287],
@@ -66,16 +83,20 @@ def dict_product(dicts):  # could just use the below but it's cleaner this way
 
 # set up the reporters
 model_reporters = {
-    "Seed": lambda m: m.report_seed(m),
-    "Citizen Count": lambda m: m.count_citizen(m),
-    "Protest Count": lambda m: m.count_protest(m),
-    "Support Count": lambda m: m.count_support(m),
-    "Speed of Spread": lambda m: m.speed_of_spread(m),
-    "Security Density": lambda m: m.report_security_density(m),
-    "Private Preference": lambda m: m.report_private_preference(m),
-    "Epsilon": lambda m: m.report_epsilon(m),
-    "Threshold": lambda m: m.report_threshold(m),
+    "Seed": ProtestCascade.report_seed,
+    "Citizen Count": ProtestCascade.count_citizen,
+    "Protest Count": ProtestCascade.count_protest,
+    "Support Count": ProtestCascade.count_support,
+    "Speed of Spread": ProtestCascade.speed_of_spread,
+    "Defection Count": ProtestCascade.count_defected,
+    "Security Density": ProtestCascade.report_security_density,
+    "Private Preference": ProtestCascade.report_private_preference,
+    "Epsilon": ProtestCascade.report_epsilon,
+    "Threshold": ProtestCascade.report_threshold,
 }
+if fixed_parameters["memory_profile"] is not None:
+    model_reporters["Peak RSS"] = ProtestCascade.report_peak_rss
+    model_reporters["Bytes per Agent"] = ProtestCascade.report_bytes_per_agent
 
 agent_reporters = {
     "pos": "pos",
@@ -95,6 +116,16 @@ agent_reporters = {
     "model_seed": "dc_seed",
 }
 
+# live metrics on http://127.0.0.1:<port>/metrics (and /metrics.json) when
+# PROTEST_CASCADE_METRICS_PORT is set
+metrics_port = os.environ.get("PROTEST_CASCADE_METRICS_PORT")
+if metrics_port:
+    registry = metrics.MetricsRegistry(
+        runs_planned=sum(len([*dict_product(p)]) for p in params)
+    )
+    metrics.serve_metrics(registry, int(metrics_port))
+    metrics.start_recorder(registry)
+
 for i, p in enumerate(params):
     parameters_list = [*dict_product(p)]
     # what to run and what to collect
@@ -112,6 +143,8 @@ for i, p in enumerate(params):
 
     # run the batches of your model with the specified variations
     batch_run.run_all()
+    if metrics.RECORDER is not None:
+        metrics.RECORDER.finish()
 
     ## NOTE: to do data collection, you need to be sure your pathway is correct to save this!
     # Data collection
@@ -140,6 +173,8 @@ for i, p in enumerate(params):
     ):
         os.makedirs(f"{path}/agent/seed_{list(batch_step_agent_raw.keys())[0][0]}")
     for key, df in batch_step_agent_raw.items():
-        df.to_csv(
-            f"{path}/agent/seed_{key[0]}/agent_seed_{key[0]}_pp_{key[1]}_sd{key[2]}_ep_{key[3]}.csv"
-        )
+        agent_file = f"{path}/agent/seed_{key[0]}/agent_seed_{key[0]}_pp_{key[1]}_sd{key[2]}_ep_{key[3]}"
+        df.to_csv(f"{agent_file}.csv")
+        # record what was sampled so downstream code can interpret the file
+        with open(f"{agent_file}.sampling.json", "w") as f:
+            json.dump(df.attrs.get("sampling", {}), f, indent=2)